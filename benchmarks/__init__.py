@@ -0,0 +1 @@
+"""Performance benchmarks of the query builder and compiler"""
@@ -0,0 +1,98 @@
+"""
+Run the benchmarks and print the results as JSON.
+
+    python -m benchmarks --output new.json --compare old.json
+"""
+import argparse
+import json
+import platform
+import sys
+import timeit
+from typing import Any, Callable, Mapping
+
+from .cases import all_cases
+
+REPEAT = 5
+MIN_TIME = 0.2  # seconds spent in a single repetition
+
+
+def measure(function: Callable[[], object], repeat: int) -> Mapping[str, Any]:
+    """Time the function, keeping the best of `repeat` repetitions"""
+    timer = timeit.Timer(function)
+    number = 1
+    while timer.timeit(number) < MIN_TIME:
+        number *= 10
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+
+    return {
+        'seconds_per_op': best,
+        'ops_per_second': 1 / best,
+        'number': number,
+        'repeat': repeat,
+    }
+
+
+def compare(
+        results: Mapping[str, Mapping[str, Any]],
+        baseline: Mapping[str, Mapping[str, Any]],
+        threshold: float,
+) -> bool:
+    """Report the slowdown against the baseline, False on regressions"""
+    success = True
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['seconds_per_op'] / baseline[name]['seconds_per_op']
+        regression = ratio > threshold
+        success = success and not regression
+        flag = '  REGRESSION' if regression else ''
+        print('%-40s %8.2fx%s' % (name, ratio, flag), file=sys.stderr)
+
+    return success
+
+
+def main() -> int:
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('--filter', default='', help='run matching cases only')
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--output', help='write the JSON results to a file')
+    parser.add_argument('--compare', help='JSON results of a previous run')
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=1.25,
+        help='slowdown ratio considered a regression',
+    )
+    args = parser.parse_args()
+
+    results = {
+        name: measure(function, args.repeat)
+        for name, function in all_cases()
+        if args.filter in name
+    }
+    report = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+
+    dumped = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(dumped + '\n')
+    else:
+        print(dumped)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)['results']
+        if not compare(results, baseline, args.threshold):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""Benchmark cases, none of them needs a running Neo4j"""
+from typing import Callable, Dict, Iterator, Tuple
+
+from neo4j.types.graph import Graph
+
+from neopath import entities as new_entities
+from neopath._ import attributes, entities
+from neopath._.query import CACHE, Query
+from neopath.props import Prop
+
+Case = Tuple[str, Callable[[], object]]
+
+HOPS = (2, 4, 6, 8, 10)
+CONDITIONS = (1, 10, 100, 500)
+
+
+class Airport(entities.Node):
+    """Node used by the benchmarks"""
+    iata = attributes.AnyAttr()
+    name = attributes.AnyAttr()
+
+
+class Flight(entities.Edge):
+    """Edge used by the benchmarks"""
+    number = attributes.AnyAttr()
+
+
+def chain(hops: int, min_hops: int = None, max_hops: int = None) -> Query:
+    """Build a query of `hops` edges"""
+    query = Query().match(Airport, 'a')
+    for _ in range(hops):
+        query = (query
+                 .connected_through(Flight, '', min_hops, max_hops)
+                 .to(Airport)
+                 )
+
+    return query
+
+
+def conditions(number: int) -> Query:
+    """Build a single node query with `number` conditions"""
+    query = Query().match(Airport, 'a')
+    for value in range(number):
+        query = query.where(Airport.iata != value)
+
+    return query
+
+
+def compile_cold(query: Query) -> Callable[[], object]:
+    """Compile the query bypassing the compiled queries cache"""
+    def run():
+        CACHE.clear()
+        return query.compile()
+
+    return run
+
+
+def builder_and_compiler() -> Iterator[Case]:
+    """Query build and compile throughput"""
+    builders: Dict[str, Callable[[], Query]] = {
+        'single_node': lambda: Query().match(Airport, 'a'),
+    }
+    for hops in HOPS:
+        builders['chain_%d' % hops] = lambda hops=hops: chain(hops)
+        builders['var_length_%d' % hops] = (
+            lambda hops=hops: chain(hops, min_hops=1, max_hops=3))
+    for number in CONDITIONS:
+        builders['where_%d' % number] = (
+            lambda number=number: conditions(number))
+
+    for name, builder in builders.items():
+        query = builder()
+        yield 'query.build.' + name, builder
+        yield 'query.compile.' + name, query.compile
+        yield 'query.compile_cold.' + name, compile_cold(query)
+
+
+def labels() -> Iterator[Case]:
+    """And/Or/Xor label composition"""
+    class BusStation(entities.Node):
+        """Node used by the benchmarks"""
+
+    composed = {
+        'and': lambda: Airport & BusStation & 'Hub',
+        'or': lambda: Airport | BusStation | 'Hub',
+        'xor': lambda: Airport ^ BusStation ^ 'Hub',
+        'nested': lambda: (Airport & 'Hub') | (BusStation ^ 'Hub'),
+    }
+    for name, compose in composed.items():
+        logic = compose()
+        yield 'labels.compose.' + name, compose
+        yield (
+            'labels.where.' + name,
+            lambda logic=logic: logic.get_inline_and_where(True),
+        )
+
+
+def meta_node() -> Iterator[Case]:
+    """Node class creation"""
+    def legacy():
+        class Node(entities.Node):
+            """Node created by the benchmarks"""
+            iata = attributes.AnyAttr()
+
+            class Neo:
+                """Labels of the node"""
+                labels = ('Airport', 'Hub')
+
+        return Node
+
+    def current():
+        class Node(new_entities.Node):
+            """Node created by the benchmarks"""
+            class Meta:
+                """Labels of the node"""
+                labels = ('Airport', 'Hub')
+
+        return Node
+
+    yield 'meta_node.create._', legacy
+    yield 'meta_node.create', current
+
+
+def inflation() -> Iterator[Case]:
+    """Inflation of neo4j nodes into Node instances"""
+    class Airdrome(new_entities.Node):
+        """Node used by the benchmarks"""
+        iata = Prop()
+        name = Prop()
+
+    class Hub(Airdrome):
+        """Node used by the benchmarks"""
+        terminals = Prop()
+
+    graph = Graph()
+    nodes = [
+        graph.put_node(i, ('Airdrome', 'Hub'), {
+            'iata': 'A%02d' % i, 'name': str(i), 'terminals': i,
+        })
+        for i in range(100)
+    ]
+
+    yield 'inflation.class', lambda: [Hub.inflate(node) for node in nodes]
+    yield 'inflation.registry', lambda: new_entities.inflate(nodes)
+
+
+def all_cases() -> Iterator[Case]:
+    """All the benchmark cases"""
+    yield from builder_and_compiler()
+    yield from labels()
+    yield from meta_node()
+    yield from inflation()
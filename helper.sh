@@ -2,7 +2,7 @@
 
 if [ -z $1 ]
 then
-    echo "No command passed to script. Available commands: test, cover, lint."
+    echo "No command passed to script. Available commands: test, cover, lint, bench."
     exit 1
 elif [ $1 = "test" ]
 then
@@ -14,7 +14,11 @@ then
 elif [ $1 = "lint" ]
 then
     docker exec -it neopath pylint neopath/* tests/*
+elif [ $1 = "bench" ]
+then
+    shift
+    docker exec -it neopath python -m benchmarks "$@"
 else
-    echo "$1 is not a valid command. Available commands: test, cover, lint."
+    echo "$1 is not a valid command. Available commands: test, cover, lint, bench."
     exit 2
 fi
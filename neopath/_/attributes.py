@@ -39,11 +39,19 @@ class Attr:
             cls.check_constraints,
         ))
 
+    def __call__(self, var: str) -> 'BoundAttr':
+        """Bind the attribute to a variable of the query"""
+        return BoundAttr(attribute=self, var=var)
+
     def _compare(self, other: Any, operator: str) -> 'Comparison':
         return Comparison(attribute=self, operator=operator, other=other)
 
     __eq__: Callable[[], 'Comparison'] = partialmethod(_compare, operator='=')
     __ne__: Callable[[], 'Comparison'] = partialmethod(_compare, operator='<>')
+    __lt__: Callable[[], 'Comparison'] = partialmethod(_compare, operator='<')
+    __le__: Callable[[], 'Comparison'] = partialmethod(_compare, operator='<=')
+    __gt__: Callable[[], 'Comparison'] = partialmethod(_compare, operator='>')
+    __ge__: Callable[[], 'Comparison'] = partialmethod(_compare, operator='>=')
 
 
 class AnyAttr(Attr):
@@ -54,6 +62,12 @@ class AnyAttr(Attr):
         return True
 
 
+class BoundAttr(NamedTuple):
+    """An attribute of a particular variable of the query"""
+    attribute: Attr  # the attribute
+    var: str  # variable of the node or edge in the query
+
+
 class Comparison(NamedTuple):
     """Data needed to build a comparison"""
     attribute: Attr  # the attribute being compared
@@ -1,5 +1,574 @@
 """Database related objects"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from itertools import chain, islice
+from threading import Lock
+from time import monotonic
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from neo4j import GraphDatabase
+from neo4j.exceptions import (
+    ConnectionExpired,
+    ProtocolError,
+    ServiceUnavailable,
+)
+
+try:
+    from neo4j.exceptions import SessionExpired
+except ImportError:  # The 1.7 driver defines it at the top level.
+    from neo4j import SessionExpired
+
+try:
+    from neo4j import AsyncGraphDatabase
+except ImportError:  # The driver has no asyncio support before 5.0.
+    AsyncGraphDatabase = None
+
+from ..batch import DEFAULT_BUDGET, DEFAULT_CHUNK_SIZE, Batch, execute, upserts
+from ..entities import Endpoints, Entity, Node
+from .query import Executable, Query, Template
+
+Runnable = Union[Query, Template, str]
+
+DEFAULT_MAX_POOL_SIZE = 100
+DEFAULT_ACQUISITION_TIMEOUT = 60.0  # seconds
+DEFAULT_MAX_LIFETIME = 3600.0  # seconds
+DEFAULT_CONCURRENCY = 10
+DEFAULT_BATCH_SIZE = 1000
+
+
+class PoolStats(NamedTuple):
+    """Connection pool utilisation"""
+    max_size: int  # maximum number of connections
+    connections: int  # connections opened by the driver
+    in_use: int  # connections currently borrowed from the pool
+    sessions: int  # sessions currently open through the DB
+    peak_sessions: int  # maximum number of sessions open at the same time
+    acquired: int  # sessions opened through the DB since its creation
+    liveness_checks: int  # connections checked after being idle
 
 
 class DB:
-    """Database instance representation"""
+    """
+    Database instance representation.
+
+    Owns a neo4j driver and its connection pool. The instance is safe to
+    share across threads: the driver is, and every call uses its own
+    short-lived session.
+
+    The pool of the 1.7 driver has no liveness check of its own: if the DB
+    has not been used for `liveness_check_timeout` seconds, the borrowed
+    connection is checked with a `RETURN 1` before running the query.
+    """
+    def __init__(  # pylint: disable=too-many-arguments
+            self,
+            uri: str = None,
+            auth: Tuple[str, str] = None,
+            *,
+            max_pool_size: int = DEFAULT_MAX_POOL_SIZE,
+            acquisition_timeout: float = DEFAULT_ACQUISITION_TIMEOUT,
+            max_lifetime: float = DEFAULT_MAX_LIFETIME,
+            liveness_check_timeout: Optional[float] = None,
+            driver: Any = None,
+            **config: Any,
+    ):
+        self.max_pool_size = max_pool_size
+        self.liveness_check_timeout = liveness_check_timeout
+        self.driver = driver or GraphDatabase.driver(
+            uri,
+            auth=auth,
+            max_connection_pool_size=max_pool_size,
+            connection_acquisition_timeout=acquisition_timeout,
+            max_connection_lifetime=max_lifetime,
+            **config,
+        )
+
+        self._lock = Lock()
+        self._sessions = 0
+        self._peak_sessions = 0
+        self._acquired = 0
+        self._liveness_checks = 0
+        self._last_used = monotonic()
+
+    def __enter__(self) -> 'DB':
+        return self
+
+    def __exit__(self, *_exc_info):
+        self.close()
+
+    def close(self):
+        """Close the driver and all its connections"""
+        self.driver.close()
+
+    def _is_idle(self) -> bool:
+        """Check if connections may have died while nothing was running"""
+        with self._lock:
+            now = monotonic()
+            idle = (
+                self.liveness_check_timeout is not None
+                and now - self._last_used > self.liveness_check_timeout
+            )
+            self._last_used = now
+
+            return idle
+
+    def _is_alive(self, session: Any) -> bool:
+        """Check the connection of the session with a trivial query"""
+        with self._lock:
+            self._liveness_checks += 1
+        try:
+            session.run('RETURN 1').consume()
+        except (ServiceUnavailable, ConnectionExpired, SessionExpired):
+            # The driver has discarded the dead connection, routing drivers
+            # report it as an expired session.
+            return False
+
+        return True
+
+    @contextmanager
+    def session(
+            self,
+            access_mode: str = None,
+            **config: Any,
+    ) -> Iterator[Any]:
+        """Borrow a pooled session, accounting for it in the stats"""
+        with self._lock:
+            self._sessions += 1
+            self._acquired += 1
+            self._peak_sessions = max(self._peak_sessions, self._sessions)
+
+        session = self.driver.session(access_mode, **config)
+        try:
+            if self._is_idle() and not self._is_alive(session):
+                session.close()
+                session = self.driver.session(access_mode, **config)
+            yield session
+        finally:
+            session.close()
+            with self._lock:
+                self._sessions -= 1
+                self._last_used = monotonic()
+
+    @staticmethod
+    def executable(
+            query: Runnable,
+            params: Mapping[str, Any] = None,
+    ) -> Executable:
+        """Compile the query once into a statement, params and a decoder"""
+        if isinstance(query, Query):
+            executable = query.executable()
+            if params:
+                executable = executable._replace(
+                    params={**executable.params, **params},
+                )
+            return executable
+        if isinstance(query, Template):
+            return Executable(
+                query.cypher,
+                query.bind(**(params or {})),
+                query.decoder,
+            )
+
+        return Executable(query, params or {}, tuple)
+
+    def run(
+            self,
+            query: Runnable,
+            params: Mapping[str, Any] = None,
+            access_mode: str = None,
+    ) -> List[Any]:
+        """
+        Run a Query, a Template or a Cypher string and decode the results.
+
+        Params of a Template are the values of its slots.
+        """
+        cypher, params, decode = self.executable(query, params)
+
+        with self.session(access_mode) as session:
+            return [decode(record) for record in session.run(cypher, params)]
+
+    def stream(  # pylint: disable=too-many-arguments
+            self,
+            query: Runnable,
+            params: Mapping[str, Any] = None,
+            *,
+            inflate: Callable[[Any], Any] = None,
+            fetch_size: int = DEFAULT_BATCH_SIZE,
+            access_mode: str = None,
+    ) -> Iterator[Any]:
+        """
+        Run the query and lazily yield its decoded records.
+
+        Records are pulled from the connection as the generator is consumed,
+        `inflate` is applied to each value of a record just before yielding
+        it, e.g. `Airport.inflate`. Closing the generator early discards the
+        rest of the result on the server.
+        """
+        cypher, params, decode = self.executable(query, params)
+
+        with self.session(access_mode, fetch_size=fetch_size) as session:
+            exhausted = False
+            try:
+                for record in session.run(cypher, params):
+                    if inflate is not None:
+                        record = tuple(map(inflate, record))
+                    yield decode(record)
+                exhausted = True
+            finally:
+                if not exhausted:
+                    self._cancel(session)
+
+    @staticmethod
+    def _cancel(session: Any):
+        """Make the server discard the rest of the running result"""
+        # The 1.7 driver fetches the remaining records when the session is
+        # closed, a RESET interrupts the statement instead.
+        connection = getattr(session, '_connection', None)
+        if connection is None or not hasattr(connection, 'reset'):
+            return
+        try:
+            connection.reset()
+        except (ServiceUnavailable, ConnectionExpired, ProtocolError):
+            # The driver has discarded the connection.
+            pass
+
+    def batch(self, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Batch:
+        """
+        Buffer entities to save them in bulk:
+
+            with db.batch() as pending:
+                pending.add(node)
+        """
+        return Batch(self, chunk_size)
+
+    def save_many(
+            self,
+            entities: Iterable[Entity],
+            chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ):
+        """
+        Save the entities with one UNWIND statement, and transaction, per
+        chunk of entities having the same labels, or type, and changed props.
+        """
+        with self.batch(chunk_size) as pending:
+            pending.extend(entities)
+
+    def upsert_many(
+            self,
+            nodes: Iterable[Node],
+            chunk_size: int = DEFAULT_CHUNK_SIZE,
+            budget: int = DEFAULT_BUDGET,
+    ):
+        """
+        Create or update the nodes by primary key with UNWIND and MERGE.
+
+        The nodes are streamed in chunks of at most `chunk_size` nodes, whose
+        rows are estimated to stay under `budget` bytes, one transaction per
+        chunk.
+        """
+        for write in upserts(nodes, chunk_size, budget):
+            execute(write, self)
+
+    def stats(self) -> PoolStats:
+        """Report the connection pool utilisation"""
+        # The driver does not expose its pool publicly.
+        pool = getattr(self.driver, '_pool', None)
+        with getattr(pool, 'lock', None) or nullcontext():
+            connections = [
+                connection
+                for by_address in getattr(pool, 'connections', {}).values()
+                for connection in by_address
+            ]
+
+        with self._lock:
+            return PoolStats(
+                max_size=self.max_pool_size,
+                connections=len(connections),
+                in_use=sum(1 for c in connections if c.in_use),
+                sessions=self._sessions,
+                peak_sessions=self._peak_sessions,
+                acquired=self._acquired,
+                liveness_checks=self._liveness_checks,
+            )
+
+
+class AsyncDB:
+    """
+    Asyncio database instance representation.
+
+    Backed by the async driver when it is available. Otherwise, queries of a
+    sync DB run on a bounded pool of worker threads, records being pulled in
+    batches so the event loop is never blocked.
+
+    At most `concurrency` queries run at the same time, the others wait for
+    their turn without holding a connection.
+    """
+    def __init__(  # pylint: disable=too-many-arguments
+            self,
+            uri: str = None,
+            auth: Tuple[str, str] = None,
+            *,
+            concurrency: int = DEFAULT_CONCURRENCY,
+            batch_size: int = DEFAULT_BATCH_SIZE,
+            db: DB = None,
+            **config: Any,
+    ):
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.driver: Any = None
+        self.db: Optional[DB] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        if db is None and AsyncGraphDatabase is not None:
+            self.driver = AsyncGraphDatabase.driver(
+                uri,
+                auth=auth,
+                max_connection_pool_size=concurrency,
+                **config,
+            )
+        else:
+            self.db = db or DB(uri, auth, max_pool_size=concurrency, **config)
+            self._executor = ThreadPoolExecutor(concurrency, 'neopath')
+
+    async def __aenter__(self) -> 'AsyncDB':
+        return self
+
+    async def __aexit__(self, *_exc_info):
+        await self.close()
+
+    async def close(self):
+        """Close the driver and all its connections"""
+        if self.driver is not None:
+            await self.driver.close()
+        else:
+            self._executor.shutdown(wait=False)
+            self.db.close()
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        """The concurrency limit, bound to the running loop"""
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._loop = loop
+        return self._semaphore
+
+    async def _in_thread(self, function, *args) -> Any:
+        """Run a blocking function on a worker thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, function, *args)
+
+    async def _stream_async(
+            self,
+            cypher: str,
+            params: Mapping[str, Any],
+            access_mode: Optional[str],
+    ) -> AsyncIterator[Any]:
+        """Stream the records with the async driver"""
+        config = {'default_access_mode': access_mode} if access_mode else {}
+        async with self.driver.session(**config) as session:
+            result = await session.run(cypher, params)
+            async for record in result:
+                yield record
+
+    async def _stream_in_thread(
+            self,
+            cypher: str,
+            params: Mapping[str, Any],
+            access_mode: Optional[str],
+    ) -> AsyncIterator[Any]:
+        """
+        Stream the records of a sync session, batch by batch. Stopping early
+        discards the rest of the result on the server, as DB.stream does.
+        """
+        borrowed = self.db.session(access_mode)
+        session = await self._in_thread(borrowed.__enter__)
+        exhausted = False
+        try:
+            records = iter(await self._in_thread(session.run, cypher, params))
+            while not exhausted:
+                batch = await self._in_thread(
+                    list, islice(records, self.batch_size),
+                )
+                exhausted = len(batch) < self.batch_size
+                for record in batch:
+                    yield record
+        finally:
+            if not exhausted:
+                await self._in_thread(DB._cancel, session)
+            await self._in_thread(borrowed.__exit__, None, None, None)
+
+    async def stream(
+            self,
+            query: Runnable,
+            params: Mapping[str, Any] = None,
+            access_mode: str = None,
+    ) -> AsyncIterator[Any]:
+        """Run the query and yield its decoded records as they arrive"""
+        cypher, params, decode = DB.executable(query, params)
+        stream = (
+            self._stream_async if self.driver is not None
+            else self._stream_in_thread
+        )
+
+        async with self.semaphore:
+            records = stream(cypher, params, access_mode)
+            try:
+                async for record in records:
+                    yield decode(record)
+            finally:
+                await records.aclose()
+
+    async def fetch(
+            self,
+            query: Runnable,
+            params: Mapping[str, Any] = None,
+            access_mode: str = None,
+    ) -> List[Any]:
+        """Run the query and return all its decoded records"""
+        return [
+            row async for row in self.stream(query, params, access_mode)
+        ]
+
+    async def fetch_one(
+            self,
+            query: Runnable,
+            params: Mapping[str, Any] = None,
+            access_mode: str = None,
+    ) -> Optional[Any]:
+        """Run the query and return its first decoded record, if any"""
+        rows = self.stream(query, params, access_mode)
+        try:
+            async for row in rows:
+                return row
+            return None
+        finally:
+            await rows.aclose()
+
+
+class Session(Endpoints):
+    """
+    Unit of work over a DB.
+
+    Results are inflated through identity maps, by internal id and by
+    primary key: a node is inflated once per session and the same instance
+    is returned by every row and query. Changes to these entities and the
+    added ones are written together, in bulk, on `commit`. Used as a context
+    manager, the session commits on exit unless an exception was raised.
+
+        with Session(db) as session:
+            for (airport,) in session.run(query):
+                airport.name = airport.name.title()
+    """
+    def __init__(self, db: DB, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        super().__init__(db)
+        self.db = db
+        self.chunk_size = chunk_size
+        # Nodes by the class declaring their primary key, and its value.
+        self.keys: Dict[Tuple[type, Any], Node] = {}
+        self._added: Dict[int, Entity] = {}
+
+    def __enter__(self) -> 'Session':
+        return self
+
+    def __exit__(self, exc_type, *_exc_info):
+        if exc_type is None:
+            self.commit()
+
+    def remember(self, entity_id: int, entity: Any):
+        """Add an inflated entity to the identity maps"""
+        super().remember(entity_id, entity)
+        if isinstance(entity, Node) and entity._meta.primary_key is not None:
+            key_class = self._key_class(type(entity))
+            self.keys[(key_class, entity._key_value())] = entity
+
+    @staticmethod
+    def _key_class(cls: type) -> type:
+        """The furthest base of the class sharing its primary key"""
+        primary_key = cls._meta.primary_key
+        key_class = cls
+        for base in cls.__mro__[1:]:
+            meta = getattr(base, '_meta', None)
+            if getattr(meta, 'primary_key', None) != primary_key:
+                break
+            key_class = base
+
+        return key_class
+
+    def stream(
+            self,
+            query: Runnable,
+            params: Mapping[str, Any] = None,
+            **options: Any,
+    ) -> Iterator[Any]:
+        """Lazily yield the records of the query, see DB.stream"""
+        return self.db.stream(query, params, inflate=self.inflate, **options)
+
+    def run(
+            self,
+            query: Runnable,
+            params: Mapping[str, Any] = None,
+            access_mode: str = None,
+    ) -> List[Any]:
+        """Run the query, inflating its results through the identity maps"""
+        return list(self.stream(query, params, access_mode=access_mode))
+
+    def get(self, cls: type, key: Any) -> Optional[Node]:
+        """Return the node of the class having the primary key value"""
+        node = self.keys.get((self._key_class(cls), key))
+        if isinstance(node, cls):
+            return node
+
+        statement = 'MATCH (e:%s {%s: $key})\nRETURN e\nLIMIT 1' % (
+            ':'.join(sorted(cls.labels)),
+            cls._meta.primary_key,
+        )
+        for (node,) in self.run(statement, {'key': key}):
+            return node
+
+        return None
+
+    def add(self, entity: Entity):
+        """Save the entity on the next commit"""
+        self._added[id(entity)] = entity
+
+    def commit(self):
+        """
+        Write the added entities and the changes of the inflated ones in a
+        single transaction: if a write fails, nothing is written and the
+        entities keep their state, to be committed again
+        """
+        entities = [*self._added.values(), *(
+            entity for entity in chain(self.nodes.values(), self.edges.values())
+            if isinstance(entity, Entity) and entity._changed
+        )]
+        states = [(entity, entity._id, entity._changed) for entity in entities]
+        try:
+            with self.db.session() as session:
+                with session.begin_transaction() as transaction:
+                    with Batch(transaction, self.chunk_size) as batch:
+                        batch.extend(entities)
+        except Exception:
+            for entity, entity_id, changed in states:
+                entity._id, entity._changed = entity_id, changed
+            raise
+        self._added = {}
+
+        for entity in entities:
+            if entity._id is not None:
+                self.remember(entity._id, entity)
@@ -1,12 +1,18 @@
 """Module containing entities"""
 import collections
 from typing import (
+    AbstractSet,
+    Any,
+    FrozenSet,
+    Optional,
     Tuple,
     Type,
     Union,
 )
+from weakref import WeakSet
 
 from . import attributes, exceptions
+from .. import logic
 
 
 Identifier = Union[str, 'BitwiseMixin', Type['Edge'], Type['Node']]
@@ -23,6 +29,30 @@ def inline_identifier_builder(identifier: Identifier) -> str:
     raise NotImplementedError
 
 
+def label_expression(identifier: Identifier) -> Any:
+    """Convert a node identifier into a `neopath.logic` expression"""
+    if isinstance(identifier, MetaNode):
+        return logic.And(*identifier.neo.labels)
+    if isinstance(identifier, Logic):
+        cls = {And: logic.And, Or: logic.Or, Xor: logic.Xor}[type(identifier)]
+        return cls(*map(label_expression, identifier.identifiers))
+    if isinstance(identifier, str):
+        return identifier
+    raise NotImplementedError
+
+
+def inline_and_where(identifier: Identifier, is_node: bool) -> Tuple[str, str]:
+    """
+    Get the inline identifier and the WHERE statement of an identifier,
+    label expressions of nodes being optimised
+    """
+    if is_node and isinstance(identifier, Logic):
+        return logic.inline_and_where(label_expression(identifier))
+    if isinstance(identifier, Logic):
+        return identifier.get_inline_and_where(is_node)
+    return inline_identifier_builder(identifier), ''
+
+
 class BitwiseMixin:
     """Mixin for &, |, ^ and ~ operators"""
     def __and__(self, other: Identifier) -> 'And':
@@ -193,37 +223,63 @@ class MetaEntity(type, BitwiseMixin):
         return cls
 
 
+def is_strings(value: Any) -> bool:
+    """Check if the value is an iterable of strings, but not a string"""
+    return (
+        not isinstance(value, str)
+        and isinstance(value, collections.Iterable)
+        and all(isinstance(item, str) for item in value)
+    )
+
+
 class NeoNode:
     """Neo property for Node"""
-    __slots__ = ('labels',)
+    __slots__ = ('labels', 'primary_key', 'indexes', 'index_label')
 
     def __init__(self, name: str, neo: Type):
         labels = getattr(neo, 'labels', [name])
-        if (
-                isinstance(labels, str)
-                or not isinstance(labels, collections.Iterable)
-                or not labels
-                or any(not isinstance(label, str) for label in labels)
-        ):
+        if not labels or not is_strings(labels):
             raise exceptions.BadNodeLabels
         self.labels: Tuple[str, ...] = tuple(sorted(labels))
 
+        primary_key = getattr(neo, 'primary_key', None)
+        indexes = getattr(neo, 'indexes', ())
+        index_label = getattr(neo, 'index_label', self.labels[0])
+        if (
+                primary_key is not None and not isinstance(primary_key, str)
+                or not is_strings(indexes)
+                or index_label not in self.labels
+        ):
+            raise exceptions.BadIndexes
+        # Name of the property holding a unique identifier of the node.
+        self.primary_key: Optional[str] = primary_key
+        # Names of the indexed properties, including the primary key.
+        self.indexes: FrozenSet[str] = frozenset(indexes).union(
+            (primary_key,) if primary_key else ()
+        )
+        # The label the indexes are declared on.
+        self.index_label: str = index_label
+
 
 class MetaNode(MetaEntity):
     """Metaclass for Node"""
+    # All the Node subclasses alive.
+    registry: AbstractSet[Type['Node']] = WeakSet()
+
     def __new__(mcs: Type, name: str, bases: Tuple[Type, ...], attrs: dict):
         """Remove `Neo` attribute, add `neo`"""
         neo = attrs.pop('Neo', None)
         cls = super().__new__(mcs, name, bases, attrs)
 
         cls.neo = NeoNode(cls.__name__, neo)
+        MetaNode.registry.add(cls)
 
         return cls
 
 
 class NeoEdge:
     """Neo property for Edge"""
-    __slots__ = ('type',)
+    __slots__ = ('type', 'indexes')
 
     def __init__(self, name: str, neo: Type):
         edge_type = getattr(neo, 'type', name.upper())
@@ -231,15 +287,25 @@ class NeoEdge:
             raise exceptions.BadEdgeType
         self.type: str = edge_type
 
+        indexes = getattr(neo, 'indexes', ())
+        if not is_strings(indexes):
+            raise exceptions.BadIndexes
+        # Names of the indexed properties.
+        self.indexes: FrozenSet[str] = frozenset(indexes)
+
 
 class MetaEdge(MetaEntity):
     """Metaclass for Edge"""
+    # All the Edge subclasses alive.
+    registry: AbstractSet[Type['Edge']] = WeakSet()
+
     def __new__(mcs: Type, name: str, bases: Tuple[Type, ...], attrs: dict):
         """Remove `Neo` attribute, add `neo`"""
         neo = attrs.pop('Neo', None)
         cls = super().__new__(mcs, name, bases, attrs)
 
         cls.neo = NeoEdge(cls.__name__, neo)
+        MetaEdge.registry.add(cls)
 
         return cls
 
@@ -18,6 +18,14 @@ class BadNodeLabels(NeopathException):
     message = 'Neo.labels should be an iterable of strings and not a string'
 
 
+class BadIndexes(NeopathException):
+    """Wrong indexes declaration in a Neo class"""
+    message = (
+        'Neo.primary_key should be a string, Neo.indexes an iterable of '
+        'strings and Neo.index_label one of the labels'
+    )
+
+
 class BadEdgeType(NeopathException):
     """Wrong `type` property assigned to a NeoType class"""
     message = 'Neo.type should be a string'
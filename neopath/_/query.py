@@ -1,14 +1,23 @@
 """Query builder"""
+from collections import OrderedDict
 from itertools import count, product
+from operator import itemgetter
 from string import ascii_lowercase
+from threading import Lock
+from types import MappingProxyType
 from typing import (
     Any,
     Callable,
+    Dict,
+    Hashable,
+    Iterable,
     Iterator,
+    List,
     Mapping,
     NamedTuple,
     NoReturn,
     Optional,
+    Sequence,
     Set,
     Tuple,
     Type,
@@ -16,12 +25,15 @@ from typing import (
 )
 
 from . import attributes, entities, exceptions
+from .. import logic
+from .. import entities as models
 
 
 NodeIdentifier = Union[Type[entities.Node], str]
 EdgeIdentifier = Union[Type[entities.Edge], str]
 EntityIdentifier = Union[NodeIdentifier, EdgeIdentifier]
-WhereStatement = Union[str, attributes.Comparison]
+WhereStatement = Union[str, 'Labels', attributes.Comparison]
+Field = Union[attributes.Attr, attributes.BoundAttr]
 Conditions = Tuple['Condition', ...]
 Rows = Tuple['Row', ...]
 
@@ -29,6 +41,31 @@ START_WITH_MATCH = 'A matching query should start with a `match` method'
 EDGE_BEFORE_NODE = 'Two nodes should be connected through an edge'
 EDGE_AFTER_EDGE = 'Edge can not exist right after another edge'
 DOUBLE_MATCH = 'Method `match` can only be used once per query'
+MISSING_SLOTS = 'Values are missing for slots: %s'
+NOT_IN_QUERY = '%s is not matched by the query'
+BAD_PAGING = 'SKIP and LIMIT should be non-negative integers'
+BAD_AGGREGATE = 'Unknown aggregating function %s or no field for it'
+UNKNOWN_SLOTS = 'The template has no slots: %s'
+BAD_PREFETCH = 'Related entities can only be prefetched for a node'
+TAKEN_VAR = 'Variable %s is already used by the query'
+HOPS_FIELD = 'Properties of variable-length edges are lists of values'
+PREFETCH_MODE = 'Prefetched entities can not be counted or aggregated'
+
+CACHE_SIZE = 256  # number of compiled query shapes kept in memory
+SKIP_VAR = '_skip'  # can not be produced by `vars_generator`
+LIMIT_VAR = '_limit'
+INDEXED_OPERATORS = frozenset(('=', '<', '<=', '>', '>='))
+COUNT = 'count'
+EXISTS = 'exists'
+AGGREGATE = 'aggregate'
+AGGREGATING_FUNCTIONS = frozenset((
+    'avg',
+    'collect',
+    'count',
+    'max',
+    'min',
+    'sum',
+))
 
 
 def mapper_builder(identifier: EntityIdentifier) -> Callable:
@@ -49,6 +86,223 @@ def vars_generator(taken: Set[str] = None) -> Iterator[str]:
             yield var
 
 
+class CacheInfo(NamedTuple):
+    """Statistics of the compiled queries cache"""
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+class CompiledCache:
+    """Thread-safe bounded LRU cache of compiled queries"""
+    def __init__(self, maxsize: int = CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable) -> Any:
+        """Return the cached value or None, counting hits and misses"""
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> NoReturn:
+        """Store the value, evicting the least recently used one if full"""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> NoReturn:
+        """Drop all the cached values and reset the counters"""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self) -> CacheInfo:
+        """Report the cache statistics"""
+        with self._lock:
+            return CacheInfo(
+                self.hits,
+                self.misses,
+                self.maxsize,
+                len(self._data),
+            )
+
+
+CACHE = CompiledCache()
+
+
+def cache_info() -> CacheInfo:
+    """Report hits and misses of the compiled queries cache"""
+    return CACHE.info()
+
+
+def typed_key(value: Any) -> Hashable:
+    """
+    Build a hashable key of the value and the types of everything in it,
+    so that `[1]` and `[True]` or `1` and `1.0` are told apart
+    """
+    if isinstance(value, (list, tuple)):
+        return type(value), tuple(map(typed_key, value))
+    if isinstance(value, dict):
+        return dict, frozenset(
+            (typed_key(key), typed_key(item)) for key, item in value.items()
+        )
+    return type(value), value
+
+
+class Params:
+    """
+    Cypher parameters collector.
+
+    Values of the same type, down to the items of lists and maps, and equal
+    to each other share one variable. Values are looked up by identity
+    first, so the same big list or map bound several times is not compared
+    item by item.
+    """
+    def __init__(self):
+        self.values: Dict[str, Any] = {}
+        self._vars = vars_generator()
+        self._by_identity: Dict[int, Tuple[Any, str]] = {}
+        self._by_value: Dict[Hashable, str] = {}
+
+    @staticmethod
+    def _key(value: Any) -> Optional[Hashable]:
+        """Key of the value among the values added before, if hashable"""
+        key = typed_key(value)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def add(self, value: Any) -> str:
+        """Return the variable for the value, registering it if needed"""
+        known = self._by_identity.get(id(value))
+        if known is not None:
+            return known[1]
+
+        key = self._key(value)
+        var = None if key is None else self._by_value.get(key)
+        if var is None:
+            var = next(self._vars)
+            self.values[var] = value
+            if key is not None:
+                self._by_value[key] = var
+
+        # The value is kept alongside to make sure its id is not reused.
+        self._by_identity[id(value)] = (value, var)
+
+        return var
+
+
+class Chain:
+    """
+    Persistent sequence sharing its prefix with the chain it was built from.
+
+    Appending is O(1), a tuple is materialised only when items are requested.
+    """
+    __slots__ = ('_previous', '_item', '_length', '_items')
+
+    def __init__(self, items: Iterable = ()):
+        self._previous: Optional[Chain] = None
+        self._item: Any = None
+        self._items: Optional[tuple] = tuple(items)
+        self._length: int = len(self._items)
+
+    def append(self, item: Any) -> 'Chain':
+        """Return a new chain with the item added to the end"""
+        chain = Chain.__new__(Chain)
+        chain._previous = self
+        chain._item = item
+        chain._items = None
+        chain._length = self._length + 1
+
+        return chain
+
+    def extend(self, items: Iterable) -> 'Chain':
+        """Return a new chain with the items added to the end"""
+        chain = self
+        for item in items:
+            chain = chain.append(item)
+
+        return chain
+
+    def items(self) -> tuple:
+        """Materialise the chain into a tuple, caching the result"""
+        if self._items is None:
+            collected = []
+            link = self
+            while link._items is None:
+                collected.append(link._item)
+                link = link._previous
+            collected.reverse()
+            self._items = link._items + tuple(collected)
+
+        return self._items
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator:
+        return iter(self.items())
+
+
+class Slot(NamedTuple):
+    """A named placeholder for a value bound later through a Template"""
+    name: str
+
+
+class Compiled(NamedTuple):
+    """A compiled query shape, as stored in the cache"""
+    cypher: str  # the compiled Cypher query
+    decoder: Callable[[Sequence], Any]  # result record decoder
+
+
+class Executable(NamedTuple):
+    """Everything needed to run a query and decode its results"""
+    cypher: str  # the compiled Cypher query
+    params: Mapping[str, Any]  # parameters of the query
+    decoder: Callable[[Sequence], Any]  # result record decoder
+
+
+class Template(NamedTuple):
+    """An immutable compiled query with named slots for the values"""
+    cypher: str  # the compiled Cypher query
+    params: Mapping[str, Any]  # values known at the preparation time
+    slots: Mapping[str, Tuple[str, ...]]  # slot name -> Cypher variables
+    decoder: Callable[[Sequence], Any] = tuple  # result record decoder
+
+    def bind(self, **values: Any) -> Dict[str, Any]:
+        """Build the parameters for the Cypher query from the slot values"""
+        if values.keys() != self.slots.keys():
+            unknown = values.keys() - self.slots.keys()
+            if unknown:
+                raise exceptions.BadQuery(
+                    UNKNOWN_SLOTS % ', '.join(sorted(unknown)))
+            raise exceptions.BadQuery(
+                MISSING_SLOTS % ', '.join(sorted(self.slots.keys() - values)))
+
+        params = dict(self.params)
+        for name, value in values.items():
+            for var in self.slots[name]:
+                params[var] = value
+
+        return params
+
+
 class Row(NamedTuple):
     """Compositional unit for the Query.table"""
     mapper: Callable  # mapper into Python object for the returned value
@@ -85,6 +339,13 @@ class Row(NamedTuple):
         return self._replace(**data)
 
 
+class Labels(NamedTuple):
+    """A label expression of a node, `{0}` standing for its variable"""
+    template: str
+    # Labels of each branch if the expression is a disjunction of labels.
+    branches: Tuple[Tuple[str, ...], ...] = ()
+
+
 class Condition(NamedTuple):
     """A `WHERE` condition description"""
     row: int  # Row number to which this condition belongs
@@ -95,6 +356,8 @@ class Condition(NamedTuple):
         """Compile the condition"""
         if isinstance(self.where, str):
             return self.where
+        if isinstance(self.where, Labels):
+            return self.where.template.format(var)
         return '%s.%s %s $%s' % (
             var,
             self.where.attribute.prop_name,
@@ -102,40 +365,309 @@ class Condition(NamedTuple):
             self.value_var,
         )
 
+    def shape(self) -> Hashable:
+        """Describe the condition leaving the compared value out"""
+        if isinstance(self.where, (str, Labels)):
+            return self.row, self.where
+        return (
+            self.row,
+            self.where.attribute.entity,
+            self.where.attribute.prop_name,
+            self.where.operator,
+        )
+
+
+class Order(NamedTuple):
+    """An `ORDER BY` item"""
+    row: Optional[int]  # row of the sorted property, None for expressions
+    prop: str  # property name, or a Cypher expression if row is None
+    descending: bool = False
+
+    def build(self, table: Rows) -> str:
+        """Compile the item"""
+        expression = (
+            self.prop if self.row is None
+            else '%s.%s' % (table[self.row].var, self.prop)
+        )
+
+        return expression + (' DESC' if self.descending else '')
+
+
+class Aggregate(NamedTuple):
+    """An aggregating function over a field, over `*` if there is no field"""
+    function: str  # one of AGGREGATING_FUNCTIONS
+    field: Union['Field', str, None] = None  # attribute, variable or None
+
+
+class Aggregation(NamedTuple):
+    """A resolved Aggregate, ready to be compiled"""
+    alias: str  # name of the returned column
+    function: str
+    row: Optional[int] = None  # None for `*`
+    prop: Optional[str] = None  # None to aggregate whole entities
+
+    def build(self, table: Rows) -> str:
+        """Compile the aggregation"""
+        if self.row is None:
+            target = '*'
+        elif self.prop is None:
+            target = table[self.row].var
+        else:
+            target = '%s.%s' % (table[self.row].var, self.prop)
+
+        # Aliases are quoted, keywords like `all` being fine as names.
+        return '%s(%s) AS `%s`' % (
+            self.function,
+            target,
+            self.alias.replace('`', '``'),
+        )
+
+
+class Prefetch(NamedTuple):
+    """Entities related to a node, collected for each result"""
+    into: str  # name of the returned list
+    row: int  # row of the node
+    edge: str  # inline identifier of the edge
+    node: str  # inline identifier of the related node
+    direction: Optional[bool] = None  # as for Row
+    edges: bool = False  # collect the edges instead of the related nodes
+
+    def build(self, table: Rows, var: str) -> str:
+        """Compile the `OPTIONAL MATCH` binding the related entity to var"""
+        return 'OPTIONAL MATCH (%s)%s-[%s%s]-%s(%s%s)' % (
+            table[self.row].var,
+            '<' if self.direction is False else '',
+            var if self.edges else '',
+            self.edge,
+            '>' if self.direction is True else '',
+            '' if self.edges else var,
+            self.node,
+        )
+
+
+def carried_vars(table: Rows) -> List[str]:
+    """Variables bound by the MATCH and WITH parts of a query"""
+    carried = []
+    for row in table:
+        if row.var:
+            carried.append(row.var)
+        if row.hops:
+            carried.extend((row.edges_var, row.nodes_var))
+
+    return carried
+
+
+class Ending(NamedTuple):
+    """The `RETURN` statement and what follows it"""
+    order: Tuple[Order, ...] = ()
+    skip: Any = None
+    limit: Any = None
+    projection: Tuple[Tuple[int, str], ...] = ()  # (row, property name)
+    as_map: bool = False  # map projection: RETURN a {.prop, .other}
+    mode: str = ''  # '', COUNT, EXISTS or AGGREGATE
+    aggregations: Tuple[Aggregation, ...] = ()
+    prefetches: Tuple[Prefetch, ...] = ()
+
+    def shape(self) -> Hashable:
+        """Describe the ending leaving the SKIP and LIMIT values out"""
+        return self._replace(
+            skip=self.skip is None,
+            limit=self.limit is None,
+        )
+
+    def build_return(self, table: Rows) -> str:
+        """Compile the `RETURN` statement"""
+        if self.mode == COUNT:
+            return 'RETURN count(*) AS count'
+        if self.mode == EXISTS:
+            return 'RETURN count(*) > 0 AS `exists`'
+        if self.mode == AGGREGATE:
+            return 'RETURN %s' % ', '.join(
+                aggregation.build(table) for aggregation in self.aggregations
+            )
+
+        prefetched = [prefetch.into for prefetch in self.prefetches]
+        if not self.projection:
+            return 'RETURN %s' % ', '.join(sorted({
+                row.result for row in table
+            }) + prefetched)
+
+        if not self.as_map:
+            return 'RETURN %s' % ', '.join([
+                '%s.%s' % (table[row].var, prop)
+                for row, prop in self.projection
+            ] + prefetched)
+
+        props: Dict[int, List[str]] = OrderedDict()
+        for row, prop in self.projection:
+            props.setdefault(row, []).append('.' + prop)
+
+        return 'RETURN %s' % ', '.join([
+            '%s {%s}' % (table[row].var, ', '.join(row_props))
+            for row, row_props in props.items()
+        ] + prefetched)
+
+    def build_prefetches(self, table: Rows) -> List[str]:
+        """Compile an `OPTIONAL MATCH` and a `collect` per Prefetch"""
+        carried = carried_vars(table)
+
+        parts = []
+        for index, prefetch in enumerate(self.prefetches):
+            # Digits never appear in generated variables.
+            var = '_p%d' % index
+            parts.append(prefetch.build(table, var))
+            parts.append('WITH %s, collect(%s%s) AS %s' % (
+                ', '.join(carried),
+                '' if prefetch.edges else 'DISTINCT ',
+                var,
+                prefetch.into,
+            ))
+            carried.append(prefetch.into)
+
+        return parts
+
+    def build(self, table: Rows) -> List[str]:
+        """Compile the `RETURN` statement with ORDER BY, SKIP and LIMIT"""
+        order = []
+        if self.order and self.mode != EXISTS:
+            order.append('ORDER BY %s' % ', '.join(
+                item.build(table) for item in self.order
+            ))
+        paging = []
+        if self.skip is not None:
+            paging.append('SKIP $' + SKIP_VAR)
+        if self.mode == EXISTS:
+            # The first matching row is enough to answer.
+            paging.append('LIMIT 1')
+        elif self.limit is not None:
+            paging.append('LIMIT $' + LIMIT_VAR)
+
+        if not self.mode and not self.prefetches:
+            return [self.build_return(table), *order, *paging]
+        if not self.mode:
+            # Related entities are fetched for the page of results only, which
+            # is sorted again since collecting does not keep the order.
+            head = ['WITH *', *order, *paging] if paging else []
+            return [
+                *head,
+                *self.build_prefetches(table),
+                self.build_return(table),
+                *order,
+            ]
+
+        # Aggregating modes paginate the rows before aggregating them.
+        parts = [*order, *paging]
+        if parts:
+            parts.insert(0, 'WITH *')
+
+        return [*parts, self.build_return(table)]
+
+    def decoder(self, table: Rows) -> Callable[[Sequence], Any]:
+        """Build a function turning a result record into Python objects"""
+        if self.mode in (COUNT, EXISTS):
+            return itemgetter(0)
+        if self.mode == AGGREGATE:
+            aliases = tuple(item.alias for item in self.aggregations)
+            return lambda record: dict(zip(aliases, record))
+
+        if self.as_map:
+            names = tuple(OrderedDict.fromkeys(
+                table[row].var for row, _prop in self.projection
+            )) + tuple(prefetch.into for prefetch in self.prefetches)
+            return lambda record: dict(zip(names, record))
+        if not self.prefetches or self.projection:
+            return tuple
+
+        # The lists follow the columns of the rows, each is attached to its
+        # node if inflated.
+        columns = ', '.join(sorted({row.result for row in table})).split(', ')
+        targets = tuple(
+            (columns.index(table[prefetch.row].var), index, prefetch.into)
+            for index, prefetch in enumerate(self.prefetches, len(columns))
+        )
+
+        def decode(record: Sequence) -> tuple:
+            for parent, related, into in targets:
+                if isinstance(record[parent], models.Entity):
+                    # pylint: disable=protected-access
+                    record[parent]._attach(into, record[related])
+            return tuple(record)
+
+        return decode
+
+
+class Settings(NamedTuple):
+    """Switches of the query compiler"""
+    # Move `=` comparisons on nodes into the pattern: (a:Label {prop: $a}).
+    inline_equality: bool = True
+    # Add `USING INDEX` for comparisons on indexed node properties.
+    index_hints: bool = False
+    # Split a disjunction of labels on the first node into UNION ALL
+    # branches, each starting with a label scan.
+    union_labels: bool = False
+
 
 class Query:
     """Cypher query builder"""
     def __init__(
             self,
-            table: Tuple[Row, ...] = None,
-            conditions: Tuple[Condition, ...] = None,
+            table: Union[Rows, Chain] = None,
+            conditions: Union[Conditions, Chain] = None,
+            settings: Settings = None,
+            ending: Ending = None,
     ):
-        self.table = table or ()
-        self.conditions = conditions or ()
+        self._rows = table if isinstance(table, Chain) else Chain(table or ())
+        self._conditions = (
+            conditions if isinstance(conditions, Chain)
+            else Chain(conditions or ())
+        )
+        self.settings = settings or Settings()
+        self.ending = ending or Ending()
+
+    @property
+    def table(self) -> Rows:
+        """Rows of the query"""
+        return self._rows.items()
+
+    @property
+    def conditions(self) -> Conditions:
+        """Conditions of the query"""
+        return self._conditions.items()
 
     def copy(
             self,
             *,
-            table: Rows = None,
-            conditions: Conditions = None,
+            table: Union[Rows, Chain] = None,
+            conditions: Union[Conditions, Chain] = None,
+            settings: Settings = None,
+            ending: Ending = None,
     ) -> 'Query':
         """Create an identical copy of self"""
-        return Query(table or self.table, conditions or self.conditions)
+        return Query(
+            table or self._rows,
+            conditions or self._conditions,
+            settings or self.settings,
+            ending or self.ending,
+        )
+
+    def configure(self, **settings: bool) -> 'Query':
+        """Change the compiler Settings for this query"""
+        return self.copy(settings=self.settings._replace(**settings))
 
     def _add_row(self, row: Row) -> 'Query':
         """Add a row to the table returning a copied Query object"""
-        return self.copy(table=(*self.table, row))
+        return self.copy(table=self._rows.append(row))
 
     def _check_integrity(self, is_node: bool) -> NoReturn:
         """Query should be a chain of node-edge-node-edge-..."""
-        if not self.table:
+        if not self._rows:
             raise exceptions.BadQuery(START_WITH_MATCH)
 
         if is_node:
-            if len(self.table) % 2:
+            if len(self._rows) % 2:
                 raise exceptions.BadQuery(EDGE_BEFORE_NODE)
         else:
-            if not len(self.table) % 2:
+            if not len(self._rows) % 2:
                 raise exceptions.BadQuery(EDGE_AFTER_EDGE)
 
     def connected_through(  # pylint: disable=too-many-arguments
@@ -156,9 +688,10 @@ class Query:
             '' if max_hops is None else str(max_hops),
         )
 
+        inline, _where = entities.inline_and_where(identifier, False)
         row = Row(
             mapper=mapper_builder(identifier),
-            inline_identifier=entities.inline_identifier_builder(identifier),
+            inline_identifier=inline,
             var=var,
             hops=hops,
         )
@@ -172,14 +705,26 @@ class Query:
             var: Optional[str],
     ) -> 'Query':
         """Add a node to the query"""
+        # Label expressions keep the labels shared by all their branches
+        # inline for a label scan, the rest goes to `WHERE`.
+        inline, where = entities.inline_and_where(identifier, True)
         row = Row(
             mapper=mapper_builder(identifier),
-            inline_identifier=entities.inline_identifier_builder(identifier),
+            inline_identifier=inline,
             var=var,
             direction=direction,
         )
+        query = self._add_row(row)
+        if not where:
+            return query
 
-        return self._add_row(row)
+        labels = Labels(
+            where,
+            logic.label_branches(entities.label_expression(identifier)),
+        )
+        return query.copy(conditions=query._conditions.append(
+            Condition(row=len(query._rows) - 1, where=labels),
+        ))
 
     def to(  # pylint: disable=invalid-name
             self,
@@ -231,22 +776,235 @@ class Query:
         """
         Start a MATCH query.
         """
-        if self.table:
+        if self._rows:
             raise exceptions.BadQuery(DOUBLE_MATCH)
 
         return self._by_with_to(None, identifier, var)
 
     def where(self, *conditions: WhereStatement) -> 'Query':
         """Add a `WHERE` statement"""
-        query = self
+        row = len(self._rows) - 1
 
-        for condition in conditions:
-            query = query.copy(conditions=(
-                *query.conditions,
-                Condition(row=len(query.table) - 1, where=condition),
-            ))
+        return self.copy(conditions=self._conditions.extend(
+            Condition(row=row, where=condition) for condition in conditions
+        ))
+
+    def _row_of(self, attribute: attributes.Attr) -> int:
+        """Find the first row matching the entity of the attribute"""
+        for index, row in enumerate(self.table):
+            if row.mapper() is attribute.entity:
+                return index
+
+        raise exceptions.BadQuery(NOT_IN_QUERY % getattr(
+            attribute.entity, '__name__', attribute.entity,
+        ))
+
+    def _row_by_var(self, var: str) -> int:
+        """Find the row having the variable"""
+        for index, row in enumerate(self.table):
+            if row.var == var:
+                return index
+
+        raise exceptions.BadQuery(NOT_IN_QUERY % var)
+
+    def _field(self, item: Field) -> Tuple[int, str]:
+        """
+        Find the row and the property name of an attribute.
+
+        A BoundAttr is looked up by its variable, an Attr on the first row
+        matching its entity. Edges of variable length have no single value.
+        """
+        if isinstance(item, attributes.BoundAttr):
+            row, prop = self._row_by_var(item.var), item.attribute.prop_name
+        else:
+            row, prop = self._row_of(item), item.prop_name
+
+        if self.table[row].hops:
+            raise exceptions.BadQuery(HOPS_FIELD)
+        return row, prop
+
+    def order_by(
+            self,
+            *items: Union[Field, str],
+            descending: bool = False,
+    ) -> 'Query':
+        """
+        Add `ORDER BY` items.
+
+        Attributes are looked up as in `returning`, a string is used as is.
+        """
+        order = tuple(
+            Order(None, item, descending) if isinstance(item, str)
+            else Order(*self._field(item), descending)
+            for item in items
+        )
+
+        return self.copy(ending=self.ending._replace(
+            order=self.ending.order + order,
+        ))
+
+    def returning(self, *fields: Field, as_map: bool = False) -> 'Query':
+        """
+        Return only the given properties instead of whole entities.
+
+        Fields are either bound to a variable, `Airport.iata('a')`, or plain
+        attributes looked up on the first row matching their entity. The
+        query returns a column per property, or a map per variable
+        `a {.iata, .name}` if `as_map` is set.
+        """
+        return self.copy(ending=self.ending._replace(
+            projection=tuple(self._field(field) for field in fields),
+            as_map=as_map,
+        ))
+
+    def prefetch(  # pylint: disable=too-many-arguments,invalid-name
+            self,
+            identifier: EntityIdentifier,
+            into: str,
+            direction: Optional[bool] = None,
+            through: EdgeIdentifier = '',
+            of: Optional[str] = None,
+    ) -> 'Query':
+        """
+        Collect the entities related to each result in the same query.
+
+        An Edge collects the edges of the node, otherwise the nodes connected
+        to it are collected, `through` a type of edge if given. The node is
+        the last one of the query, or the one having the variable `of`, and
+        `direction` is the one of the edge as for `to`, `by` and `with_`:
+
+            Query().match(Airport, 'a').prefetch(Flight, 'flights', True)
+
+        Lists are returned after the other columns, or under the `into` key
+        for map projections. Inflated entities also get their list attached,
+        see `neopath.entities.Entity.prefetched`.
+        """
+        if self.ending.mode:
+            raise exceptions.BadQuery(PREFETCH_MODE)
+        row = len(self._rows) - 1 if of is None else self._row_by_var(of)
+        if row % 2:
+            raise exceptions.BadQuery(BAD_PREFETCH)
+        taken = {table_row.var for table_row in self.table}
+        taken.update(prefetch.into for prefetch in self.ending.prefetches)
+        if into in taken:
+            raise exceptions.BadQuery(TAKEN_VAR % into)
+
+        edges = isinstance(identifier, entities.MetaEdge)
+        edge, node = (identifier, '') if edges else (through, identifier)
+        prefetch = Prefetch(
+            into=into,
+            row=row,
+            edge=entities.inline_identifier_builder(edge),
+            node=entities.inline_identifier_builder(node),
+            direction=direction,
+            edges=edges,
+        )
+
+        return self.copy(ending=self.ending._replace(
+            prefetches=self.ending.prefetches + (prefetch,),
+        ))
+
+    def _check_mode(self) -> NoReturn:
+        """Prefetched entities are only returned along with the rows"""
+        if self.ending.prefetches:
+            raise exceptions.BadQuery(PREFETCH_MODE)
 
-        return query
+    def count(self) -> 'Query':
+        """Return the number of matching rows instead of the rows"""
+        self._check_mode()
+        return self.copy(ending=self.ending._replace(mode=COUNT))
+
+    def exists(self) -> 'Query':
+        """Return whether at least a row matches, stopping at the first one"""
+        self._check_mode()
+        return self.copy(ending=self.ending._replace(mode=EXISTS))
+
+    def aggregate(self, **aggregates: Aggregate) -> 'Query':
+        """
+        Return aggregated values computed by the server, one per keyword.
+
+        Fields of Aggregates are looked up as in `returning`, a string is
+        a variable of the query and None stands for `*`:
+
+            .aggregate(total=Aggregate('count'),
+                       first=Aggregate('min', Airport.iata('a')),
+                       all=Aggregate('collect', 'a'))
+        """
+        self._check_mode()
+        aggregations = []
+        for alias, aggregate in aggregates.items():
+            function, field = aggregate
+            if function not in AGGREGATING_FUNCTIONS or (
+                    field is None and function != 'count'
+            ):
+                raise exceptions.BadQuery(BAD_AGGREGATE % function)
+
+            if field is None:
+                row, prop = None, None
+            elif isinstance(field, str):
+                row, prop = self._row_by_var(field), None
+            else:
+                row, prop = self._field(field)
+            aggregations.append(Aggregation(alias, function, row, prop))
+
+        return self.copy(ending=self.ending._replace(
+            mode=AGGREGATE,
+            aggregations=tuple(aggregations),
+        ))
+
+    def decoder(self) -> Callable[[Sequence], Any]:
+        """
+        Return the function decoding a result record of the query.
+
+        Projections are decoded into a tuple of values, or into a dict of
+        maps by variable for map projections.
+        """
+        return self.executable().decoder
+
+    @staticmethod
+    def _check_paging(value: Any) -> NoReturn:
+        """SKIP and LIMIT accept non-negative integers or Slots"""
+        if isinstance(value, Slot):
+            return
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise exceptions.BadQuery(BAD_PAGING)
+
+    def skip(self, number: int) -> 'Query':
+        """Skip the `number` first results"""
+        self._check_paging(number)
+
+        return self.copy(ending=self.ending._replace(skip=number))
+
+    def limit(self, number: int) -> 'Query':
+        """Return at most `number` results"""
+        self._check_paging(number)
+
+        return self.copy(ending=self.ending._replace(limit=number))
+
+    def page_after(
+            self,
+            attribute: attributes.Attr,
+            value: Any = None,
+            size: int = 100,
+            descending: bool = False,
+    ) -> 'Query':
+        """
+        Keyset pagination: the page of `size` results following `value`.
+
+        The results are sorted by the attribute, preferably a primary key,
+        and instead of skipping the previous pages the query seeks right
+        after the last value seen, so deep pages cost as much as the first
+        one. Pass None as `value` to get the first page.
+        """
+        query = self.order_by(attribute, descending=descending).limit(size)
+        if value is None:
+            return query
+
+        where = attribute < value if descending else attribute > value
+
+        return query.copy(conditions=query._conditions.append(
+            Condition(row=query._row_of(attribute), where=where),
+        ))
 
     def get_table_and_conditions_with_vars(self) -> Tuple[Rows, Conditions]:
         """Populate self.table and self.conditions with appropriate variables"""
@@ -255,56 +1013,273 @@ class Query:
             for row in self.table
             if row.var and row.var.startswith('_')
         })
-        values_iterator = vars_generator()
+        params = Params()
 
         # Add required data to each row.
         table = tuple(row.autocomplete(vars_iterator) for row in self.table)
         # Assign a variable to each Condition if not just a string.
         # noinspection PyProtectedMember
         conditions = tuple(
-            condition._replace(value_var=next(values_iterator))
+            condition._replace(value_var=params.add(condition.where.other))
             if isinstance(condition.where, attributes.Comparison) else condition
             for condition in self.conditions
         )
 
         return table, conditions
 
+    def _shape_and_params(self) -> Tuple[Hashable, Mapping[str, Any]]:
+        """Collect the query fingerprint and its parameters in one walk"""
+        params = Params()
+        shapes = []
+
+        for condition in self.conditions:
+            if isinstance(condition.where, attributes.Comparison):
+                var = params.add(condition.where.other)
+                shapes.append((*condition.shape(), var))
+            else:
+                shapes.append(condition.shape())
+
+        # Everything but the mapper describes the row.
+        key = (
+            tuple(row[1:] for row in self.table),
+            tuple(shapes),
+            self.settings,
+            self.ending.shape(),
+        )
+
+        values = params.values
+        if self.ending.skip is not None:
+            values[SKIP_VAR] = self.ending.skip
+        if self.ending.limit is not None:
+            values[LIMIT_VAR] = self.ending.limit
+
+        return key, values
+
+    def fingerprint(self) -> Hashable:
+        """Structural description of the query with bound values left out"""
+        return self._shape_and_params()[0]
+
+    def executable(self) -> 'Executable':
+        """Return the compiled query, its parameters and its decoder"""
+        key, params = self._shape_and_params()
+        compiled = CACHE.get(key)
+        if compiled is None:
+            compiled = self._compile()
+            CACHE.set(key, compiled)
+
+        return Executable(compiled.cypher, params, compiled.decoder)
+
+    def compile(self) -> Tuple[str, Mapping[str, Any]]:
+        """Return the compiled Cypher query and its parameters"""
+        executable = self.executable()
+
+        return executable.cypher, executable.params
+
+    def prepare(self) -> Template:
+        """Compile the query into a Template with `Slot` values left open"""
+        cypher, params, decoder = self.executable()
+        fixed = {}
+        slots = {}
+
+        for var, value in params.items():
+            if isinstance(value, Slot):
+                slots.setdefault(value.name, []).append(var)
+            else:
+                fixed[var] = value
+
+        return Template(
+            cypher=cypher,
+            params=MappingProxyType(fixed),
+            slots=MappingProxyType({
+                name: tuple(variables) for name, variables in slots.items()
+            }),
+            decoder=decoder,
+        )
+
     def get_vars(self) -> Mapping[str, Any]:
         """Build a map of variables for the Cypher query"""
-        _table, conditions = self.get_table_and_conditions_with_vars()
-
-        return {
-            condition.value_var: condition.where.other
-            for condition in conditions
-            if not isinstance(condition.where, str)
-        }
+        return self.compile()[1]
 
     def __str__(self) -> str:
         """Return a compiled Cypher query"""
-        table, conditions = self.get_table_and_conditions_with_vars()
+        return self.compile()[0]
 
-        if len(table) == 1:
-            row = table[0]
-
-            if not self.conditions:
-                return '\n'.join((
-                    'MATCH (%s%s)' % (row.var, row.inline_identifier),
-                    'RETURN %s' % row.var
-                ))
-            return '\n'.join((
-                'MATCH (%s%s)' % (row.var, row.inline_identifier),
-                'WHERE ' + '\n  AND '.join(
-                    c.build(row.var) for c in conditions
-                ),
-                'RETURN %s' % row.var
+    def _split_inline(
+            self,
+            conditions: Conditions,
+    ) -> Tuple[Mapping[int, str], Conditions]:
+        """
+        Separate node equalities to be inlined into the pattern.
+
+        Return the inline property maps by row and the remaining conditions.
+        """
+        if not self.settings.inline_equality:
+            return {}, conditions
+
+        props: Dict[int, Dict[str, str]] = {}
+        remaining = []
+        for condition in conditions:
+            if (
+                    condition.row % 2  # edges stay in the WHERE statement
+                    or not isinstance(condition.where, attributes.Comparison)
+                    or condition.where.operator != '='
+                    or condition.where.attribute.prop_name
+                    in props.get(condition.row, ())
+            ):
+                remaining.append(condition)
+                continue
+            props.setdefault(condition.row, {})[
+                condition.where.attribute.prop_name
+            ] = '$' + condition.value_var
+
+        inline = {
+            row: ' {%s}' % ', '.join(
+                '%s: %s' % prop_and_var for prop_and_var in row_props.items()
+            )
+            for row, row_props in props.items()
+        }
+
+        return inline, tuple(remaining)
+
+    @staticmethod
+    def _index_hints(table: Rows, conditions: Conditions) -> Tuple[str, ...]:
+        """Build `USING INDEX` hints, at most one per node"""
+        hints = {}
+        for condition in conditions:
+            where = condition.where
+            if (
+                    condition.row % 2
+                    or not isinstance(where, attributes.Comparison)
+                    or where.operator not in INDEXED_OPERATORS
+                    or not isinstance(where.attribute.entity, entities.MetaNode)
+            ):
+                continue
+            entity = where.attribute.entity
+            if where.attribute.prop_name not in entity.neo.indexes:
+                continue
+
+            row = table[condition.row]
+            label = entity.neo.index_label
+            if label not in row.inline_identifier.split(':'):
+                continue
+
+            hint = 'USING INDEX %s:%s(%s)' % (
+                row.var,
+                label,
+                where.attribute.prop_name,
+            )
+            # The primary key has the priority over other indexes.
+            if (
+                    condition.row not in hints
+                    or where.attribute.prop_name == entity.neo.primary_key
+            ):
+                hints[condition.row] = hint
+
+        return tuple(hint for _row, hint in sorted(hints.items()))
+
+    def _anchor_labels(self) -> Optional[Condition]:
+        """Find the disjunction of labels to split into UNION ALL branches"""
+        if not self.settings.union_labels:
+            return None
+
+        for condition in self.conditions:
+            if (
+                    condition.row == 0
+                    and isinstance(condition.where, Labels)
+                    and condition.where.branches
+            ):
+                return condition
+
+        return None
+
+    def _compile_union(self, labels: Condition) -> Compiled:
+        """
+        Compile a query per branch of the labels of the first node and join
+        them with UNION ALL.
+
+        Each branch excludes the nodes matched by the previous ones, so that
+        the results stay the same. Unless the ending is a plain RETURN, the
+        branches are wrapped into `CALL {}` (Neo4j 4.0+) and the ending is
+        applied to the merged rows.
+        """
+        anchor, *rest = self.table
+        conditions = tuple(
+            condition for condition in self.conditions
+            if condition is not labels
+        )
+        plain = (
+            not self.ending.mode
+            and not self.ending.order
+            and not self.ending.prefetches
+            and self.ending.skip is None
+            and self.ending.limit is None
+        )
+
+        table = self.get_table_and_conditions_with_vars()[0]
+        branches = []
+        for index, branch in enumerate(labels.where.branches):
+            excluded = tuple(
+                Condition(row=0, where=Labels('NOT {0}:' + ':'.join(other)))
+                for other in labels.where.branches[:index]
+            )
+            cypher = Query(
+                (anchor._replace(inline_identifier=''.join(
+                    ':' + label for label in branch
+                )), *rest),
+                conditions + excluded,
+                self.settings._replace(union_labels=False),
+                self.ending if plain else Ending(),
+            )._compile().cypher
+            if not plain:
+                # Every variable the ending may use has to leave the branch,
+                # variable-length edges included.
+                cypher = '%s\nRETURN %s' % (
+                    cypher.rsplit('\n', 1)[0],
+                    ', '.join(sorted(carried_vars(table))),
+                )
+            branches.append(cypher)
+
+        cypher = '\nUNION ALL\n'.join(branches)
+        if not plain:
+            cypher = '\n'.join((
+                'CALL {',
+                '  ' + cypher.replace('\n', '\n  '),
+                '}',
+                *self.ending.build(table),
             ))
 
-        def stringify_match(start: Row, edge: Row, end: Row) -> str:
+        return Compiled(cypher, self.ending.decoder(table))
+
+    def _compile(self) -> Compiled:
+        """Compile the Cypher query bypassing the cache"""
+        labels = self._anchor_labels()
+        if labels is not None:
+            return self._compile_union(labels)
+
+        table, conditions = self.get_table_and_conditions_with_vars()
+        inline, remaining = self._split_inline(conditions)
+        hinted = conditions
+        if any(row.hops for row in table[1::2]):
+            # The WHERE part follows the WITH part then, so only the
+            # predicates inlined into the MATCH pattern can use a hint.
+            hinted = tuple(c for c in conditions if c not in remaining)
+        hints = (
+            self._index_hints(table, hinted)
+            if self.settings.index_hints else ()
+        )
+        conditions = remaining
+        patterns = [
+            row.var + row.inline_identifier + inline.get(index, '')
+            for index, row in enumerate(table)
+        ]
+
+        def stringify_match(start: int) -> str:
+            edge = table[start + 1]
+            end = table[start + 2]
             path = '%s = ' % edge.path_var if edge.hops else ''
 
-            return path + '(%s%s)%s-[%s%s%s]-%s(%s%s)' % (
-                start.var,
-                start.inline_identifier,
+            return path + '(%s)%s-[%s%s%s]-%s(%s)' % (
+                patterns[start],
                 '<' if end.direction is False else '',
 
                 edge.var,
@@ -312,8 +1287,7 @@ class Query:
                 edge.hops,
 
                 '>' if end.direction is True else '',
-                end.var,
-                end.inline_identifier,
+                patterns[start + 2],
             )
 
         # @TODO: change when `create` method is added
@@ -324,10 +1298,13 @@ class Query:
         # RETURN
 
         # Start with a MATCH part.
-        parts = ['MATCH %s' % ',\n      '.join(map(
-            lambda q: stringify_match(*q),
-            (table[i:i+3] for i in range(0, len(table) - 1, 2)),
-        ))]
+        if len(table) == 1:
+            parts = ['MATCH (%s)' % patterns[0]]
+        else:
+            parts = ['MATCH %s' % ',\n      '.join(
+                stringify_match(i) for i in range(0, len(table) - 1, 2)
+            )]
+        parts.extend(hints)
 
         # Append the WITH part only if needed.
         with_part = 'WITH *, %s' % ',\n        '.join(
@@ -340,15 +1317,13 @@ class Query:
             parts.append(with_part)
 
         # Append the WHERE part only if needed.
-        where_part = 'WHERE %s' % ',\n  AND '.join(
+        where_part = 'WHERE %s' % '\n  AND '.join(
             c.build(table[c.row].var) for c in conditions
         )
         if where_part != 'WHERE ':
             parts.append(where_part)
 
-        # Add the RETURN part
-        parts.append('RETURN %s' % ', '.join(sorted({
-            row.result for row in table
-        })))
+        # Add the RETURN part with ORDER BY, SKIP and LIMIT if needed.
+        parts.extend(self.ending.build(table))
 
-        return '\n'.join(parts)
+        return Compiled('\n'.join(parts), self.ending.decoder(table))
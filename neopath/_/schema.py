@@ -0,0 +1,203 @@
+"""Indexes and constraints management"""
+from typing import (
+    Any,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
+
+from . import entities
+from .. import entities as models
+
+
+Key = Tuple[bool, str, str]  # (is_node, label or type, property)
+Version = Tuple[int, ...]
+NodeType = Union[Type[entities.Node], Type[models.Node]]
+
+# The first Neo4j version supporting edge (relationship) indexes.
+EDGE_INDEXES = (4, 3)
+
+
+class Index(NamedTuple):
+    """A single property index or uniqueness constraint"""
+    label: str  # node label or edge type
+    prop: str  # the indexed property
+    unique: bool = False  # backed by a uniqueness constraint
+    is_node: bool = True  # False for edge indexes
+
+    @property
+    def key(self) -> Key:
+        """Identify the indexed property regardless of the uniqueness"""
+        return self.is_node, self.label, self.prop
+
+    def create(self) -> str:
+        """
+        Cypher statement creating the index.
+
+        The syntax of Neo4j 3.5 to 4.4 is used, but edge indexes only exist
+        since 4.3 and have a syntax of their own.
+        """
+        if self.unique:
+            return 'CREATE CONSTRAINT ON (n:%s) ASSERT n.%s IS UNIQUE' % (
+                self.label,
+                self.prop,
+            )
+        if self.is_node:
+            return 'CREATE INDEX ON :%s(%s)' % (self.label, self.prop)
+        return 'CREATE INDEX FOR ()-[r:%s]-() ON (r.%s)' % (
+            self.label,
+            self.prop,
+        )
+
+    def drop(self) -> str:
+        """Cypher statement dropping a non-unique node index"""
+        return 'DROP INDEX ON :%s(%s)' % (self.label, self.prop)
+
+
+def node_indexes(node: NodeType) -> Tuple[str, Iterable[str], Optional[str]]:
+    """Get the index label, the indexed props and the primary key of a Node"""
+    if isinstance(node, models.MetaNode):
+        meta = node._meta  # pylint: disable=protected-access
+        return meta.index_label, meta.indexes, meta.primary_key
+
+    return node.neo.index_label, node.neo.indexes, node.neo.primary_key
+
+
+def declared_indexes(
+        nodes: Iterable[NodeType] = None,
+        edges: Iterable[Type[entities.Edge]] = None,
+) -> List[Index]:
+    """
+    Collect indexes declared on Nodes and Edges, all registered by default.
+
+    Nodes of both `neopath._.entities` and `neopath.entities` are supported,
+    the keys `Node.upsert` merges on are declared on the latter.
+    """
+    if nodes is None:
+        nodes = [
+            *entities.MetaNode.registry,
+            *models.MetaNode.registry.values(),
+        ]
+    if edges is None:
+        edges = entities.MetaEdge.registry
+
+    indexes = {}
+    for node in nodes:
+        label, props, primary_key = node_indexes(node)
+        for prop in props:
+            index = Index(label, prop, prop == primary_key)
+            # Keep the strictest declaration if shared by several classes.
+            if index.key not in indexes or index.unique:
+                indexes[index.key] = index
+    for edge in edges:
+        for prop in edge.neo.indexes:
+            index = Index(edge.neo.type, prop, is_node=False)
+            indexes[index.key] = index
+
+    return sorted(indexes.values())
+
+
+def parse_version(records: Iterable[Mapping[str, Any]]) -> Version:
+    """Get the kernel version from `dbms.components()` records"""
+    for record in records:
+        if record.get('name') == 'Neo4j Kernel':
+            version = record['versions'][0].split('-')[0]
+            return tuple(int(part) for part in version.split('.'))
+
+    return ()
+
+
+def parse_index(record: Mapping[str, Any]) -> Optional[Index]:
+    """
+    Build an Index from a `db.indexes()` record.
+
+    Both Neo4j 3.5 and 4.x record formats are supported. Composite and
+    multi-token indexes can not serve a single property, they are ignored.
+    """
+    labels = record.get('labelsOrTypes') or record.get('tokenNames') or ()
+    props = record.get('properties') or ()
+    if len(labels) != 1 or len(props) != 1:
+        return None
+
+    return Index(
+        label=labels[0],
+        prop=props[0],
+        unique=(
+            record.get('uniqueness') == 'UNIQUE'
+            or record.get('type') == 'node_unique_property'
+        ),
+        is_node=record.get('entityType', 'NODE') == 'NODE',
+    )
+
+
+class Schema:
+    """
+    Compare the declared indexes with the database and create missing ones.
+
+    The `runner` is anything having a `run(statement)` method returning
+    records, a neo4j Session for instance. The server `version` is fetched
+    if not given: edge indexes are left out before Neo4j 4.3, which does
+    not support them.
+    """
+    def __init__(
+            self,
+            runner: Any,
+            nodes: Iterable[NodeType] = None,
+            edges: Iterable[Type[entities.Edge]] = None,
+            version: Version = None,
+    ):
+        self.runner = runner
+        self.nodes = nodes
+        self.edges = edges
+        self._version = version
+
+    @property
+    def version(self) -> Version:
+        """Version of the Neo4j server, fetched once"""
+        if self._version is None:
+            self._version = parse_version(self.runner.run(
+                'CALL dbms.components()'
+            ))
+
+        return self._version
+
+    def existing(self) -> List[Index]:
+        """Fetch the single property indexes from the database"""
+        indexes = (parse_index(record) for record in self.runner.run(
+            'CALL db.indexes()'
+        ))
+
+        return sorted(index for index in indexes if index is not None)
+
+    def diff(self) -> List[str]:
+        """Statements required to create all the declared indexes"""
+        existing = {index.key: index for index in self.existing()}
+        statements = []
+
+        for index in declared_indexes(self.nodes, self.edges):
+            if not index.is_node and self.version < EDGE_INDEXES:
+                continue
+            current = existing.get(index.key)
+            if current is None:
+                statements.append(index.create())
+            elif index.unique and not current.unique:
+                # A constraint can not be created over an existing index.
+                statements.append(current.drop())
+                statements.append(index.create())
+
+        return statements
+
+    def sync(self, dry_run: bool = False) -> List[str]:
+        """Apply the missing statements, return them in any case"""
+        statements = self.diff()
+
+        if not dry_run:
+            for statement in statements:
+                self.runner.run(statement)
+
+        return statements
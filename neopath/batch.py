@@ -0,0 +1,239 @@
+"""Bulk writes of entities, one UNWIND statement per chunk."""
+from typing import (
+    Any,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Sequence,
+    Tuple,
+)
+
+from .entities import Edge, Entity, Node
+
+DEFAULT_CHUNK_SIZE = 1000
+# Estimated size of the rows of a single upsert statement.
+DEFAULT_BUDGET = 8 * 2 ** 20  # bytes
+# Number of chunks buffered by a Batch before it flushes.
+BUFFERED_CHUNKS = 10
+
+# Groups are written in this order, so that edges find their endpoints.
+CREATE_NODES, UPDATE_NODES, CREATE_EDGES, UPDATE_EDGES = range(4)
+
+
+class Write(NamedTuple):
+    """A statement writing a chunk of entities."""
+    statement: str
+    params: Mapping[str, Any]
+    entities: Sequence[Entity]
+    # Names of the props written, None if they all are.
+    prop_names: Tuple[str, ...] = None
+
+
+def group_key(entity: Entity) -> Hashable:
+    """Entities with the same key are written by the same statement."""
+    if isinstance(entity, Node):
+        if entity._id is None:
+            return CREATE_NODES, tuple(sorted(entity.labels))
+        return UPDATE_NODES, tuple(sorted(entity._changed))
+    if isinstance(entity, Edge):
+        if entity._id is None:
+            return CREATE_EDGES, type(entity).type
+        return UPDATE_EDGES, tuple(sorted(entity._changed))
+
+    raise TypeError('%r is neither a Node nor an Edge' % entity)
+
+
+def statement(key: Hashable) -> str:
+    """Build the UNWIND statement writing the `$rows` of a group."""
+    kind, shape = key
+    if kind == CREATE_NODES:
+        return (
+            'UNWIND $rows AS row\n'
+            'CREATE (e:%s)\n'
+            'SET e = row[1]\n'
+            'RETURN row[0], id(e)' % ':'.join(shape)
+        )
+    if kind == CREATE_EDGES:
+        return (
+            'UNWIND $rows AS row\n'
+            'MATCH (s), (t) WHERE id(s) = row[1] AND id(t) = row[2]\n'
+            'CREATE (s)-[e:%s]->(t)\n'
+            'SET e = row[3]\n'
+            'RETURN row[0], id(e)' % shape
+        )
+
+    match = (Node if kind == UPDATE_NODES else Edge)._match % 'row[0]'
+    assignments = ', '.join(
+        'e.%s = row[%d]' % (name, index)
+        for (index, name) in enumerate(shape, 1)
+    )
+
+    return 'UNWIND $rows AS row\n%s\nSET %s' % (match, assignments)
+
+
+def row(key: Hashable, index: int, entity: Entity) -> List[Any]:
+    """Build the row of an entity, `index` being its position in the chunk."""
+    kind, shape = key
+    if kind == CREATE_NODES:
+        return [index, entity._set_values()]
+    if kind == CREATE_EDGES:
+        # Raises BadEndpoints if a node is not saved.
+        params = entity._create()[1]
+        return [index, params['start'], params['end'], params['props']]
+
+    values = entity._values(shape)
+    return [entity._id, *(values[name] for name in shape)]
+
+
+def writes(
+        entities: Iterable[Entity],
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[Write]:
+    """
+    Group the entities needing a write by label set, or type, and changed
+    props, then yield a Write per chunk of each group.
+
+    Rows are built lazily: edges created along with their endpoints get the
+    ids of the nodes once the previous writes have been run.
+    """
+    groups: Dict[Hashable, List[Entity]] = {}
+    for entity in entities:
+        if entity._id is not None and not entity._changed:
+            continue
+        groups.setdefault(group_key(entity), []).append(entity)
+
+    for key in sorted(groups, key=lambda key: key[0]):
+        group = groups[key]
+        cypher = statement(key)
+        prop_names = None if key[0] in (CREATE_NODES, CREATE_EDGES) else key[1]
+        for start in range(0, len(group), chunk_size):
+            chunk = group[start:start + chunk_size]
+            rows = [row(key, index, entity)
+                    for (index, entity) in enumerate(chunk)]
+            yield Write(cypher, {'rows': rows}, chunk, prop_names)
+
+
+def estimate_size(value: Any) -> int:
+    """Estimate the size of a parameter value sent to the server."""
+    if isinstance(value, str):
+        return 5 + len(value.encode())
+    if isinstance(value, (bytes, bytearray)):
+        return 5 + len(value)
+    if isinstance(value, (list, tuple)):
+        return 5 + sum(map(estimate_size, value))
+    if isinstance(value, dict):
+        return 5 + sum(
+            estimate_size(key) + estimate_size(item)
+            for (key, item) in value.items()
+        )
+
+    return 9
+
+
+def upserts(
+        nodes: Iterable[Node],
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        budget: int = DEFAULT_BUDGET,
+) -> Iterator[Write]:
+    """
+    Group the nodes by labels and yield a MERGE Write per chunk of a group.
+
+    The nodes are consumed lazily: a chunk is yielded as soon as it holds
+    `chunk_size` nodes or its rows are estimated to exceed the `budget`, so
+    memory stays bounded whatever the number of nodes. A node without a
+    primary key value raises NullPrimaryKey when reached, the chunks
+    yielded before it are not affected.
+    """
+    # Statement, rows, nodes and estimated size of the chunks, by group.
+    statements: Dict[Hashable, str] = {}
+    rows: Dict[Hashable, List[Any]] = {}
+    chunks: Dict[Hashable, List[Node]] = {}
+    sizes: Dict[Hashable, int] = {}
+
+    def write(key: Hashable) -> Write:
+        del sizes[key]
+        return Write(statements[key], {'rows': rows.pop(key)}, chunks.pop(key))
+
+    for node in nodes:
+        key = (type(node), node.labels)
+        if key not in statements:
+            statements[key] = (
+                'UNWIND $rows AS row\n'
+                '%s\n'
+                'SET e += row[2]\n'
+                'RETURN row[0], id(e)' % node._merge_pattern('row[1]')
+            )
+
+        group = rows.setdefault(key, [])
+        row = [len(group), node._merge_key(), node._set_values()]
+        group.append(row)
+        chunks.setdefault(key, []).append(node)
+        sizes[key] = sizes.get(key, 0) + estimate_size(row)
+        if len(group) >= chunk_size or sizes[key] >= budget:
+            yield write(key)
+
+    for key in list(chunks):
+        yield write(key)
+
+
+def execute(write: Write, runner: Any):
+    """Run a Write, then mark its entities as saved."""
+    result = runner.run(write.statement, write.params)
+    if write.prop_names is None:
+        for (index, entity_id) in result:
+            write.entities[index]._id = entity_id
+        for entity in write.entities:
+            entity._changed = frozenset()
+    else:
+        # Props changed after the grouping are still to be written.
+        for entity in write.entities:
+            entity._changed = entity._changed.difference(write.prop_names)
+
+
+class Batch:
+    """
+    Entities to save in bulk with the `runner`: a DB, a session or a
+    transaction.
+
+    Entities are buffered until `flush()`, or until `chunk_size` *
+    BUFFERED_CHUNKS of them are pending. Used as a context manager, the
+    batch is flushed on exit unless an exception was raised.
+    """
+    def __init__(self, runner: Any, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.runner = runner
+        self.chunk_size = chunk_size
+        self._pending: Dict[int, Entity] = {}
+
+    def __enter__(self) -> 'Batch':
+        return self
+
+    def __exit__(self, exc_type, *_exc_info):
+        if exc_type is None:
+            self.flush()
+
+    def add(self, entity: Entity):
+        """Save the entity with the next flush."""
+        self._pending[id(entity)] = entity
+        if len(self._pending) >= self.chunk_size * BUFFERED_CHUNKS:
+            self.flush()
+
+    def extend(self, entities: Iterable[Entity]):
+        """Save the entities with the next flushes."""
+        for entity in entities:
+            self.add(entity)
+
+    def flush(self):
+        """
+        Write all the pending entities. If a write fails, the entities not
+        written yet stay pending.
+        """
+        for write in writes(list(self._pending.values()), self.chunk_size):
+            execute(write, self.runner)
+            for entity in write.entities:
+                del self._pending[id(entity)]
+        # The rest needed no write.
+        self._pending = {}
@@ -1,9 +1,31 @@
 from types import DynamicClassAttribute
-from typing import Any, FrozenSet, Iterable, Mapping, Tuple, Type
+from typing import (
+    Any,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    Union,
+)
+from weakref import WeakValueDictionary
 
 from neo4j.types import graph
 
-from .exceptions import BadLabels
+from .exceptions import (
+    BadEndpoints,
+    BadIndexes,
+    BadLabels,
+    BadType,
+    Detached,
+    NoPrimaryKey,
+    NullPrimaryKey,
+)
 from .logic import BitwiseMixin
 from .props import Prop
 
@@ -11,21 +33,51 @@ from .props import Prop
 class MetaEntity(type, BitwiseMixin):
     """Common logic for MetaNode and MetaEdge."""
     def __new__(mcs: Type, name: str, bases: Tuple[Type, ...], attrs: dict):
+        # Each Prop stores its value in a slot, instances have no __dict__.
+        slots = attrs.get('__slots__', ())
+        slots = [slots] if isinstance(slots, str) else list(slots)
+        for (attr_name, attr) in attrs.items():
+            if isinstance(attr, Prop):
+                attr.slot = '_prop_' + attr_name
+                if not any(hasattr(base, attr.slot) for base in bases):
+                    slots.append(attr.slot)
+        attrs['__slots__'] = tuple(slots)
+
         # Creation of the entity class.
         cls = super().__new__(mcs, name, bases, attrs)
 
+        # Inherit the props of the bases.
+        props = {}
+        for base in reversed(bases):
+            props.update(getattr(base, '_props', {}))
+
         # Provide each Prop with an `entity` and a `prop_name`.
         for (attr_name, attr) in attrs.items():
             if isinstance(attr, Prop):
                 attr.entity = cls
                 if attr.prop_name is None:
                     attr.prop_name = attr_name
+                props[attr.prop_name] = attr
+
+        # The declared props, by their name in the database.
+        cls._props = props
 
         return cls
 
 
+class _NoMatch:
+    """Cached best match of labels no Node subclass matches."""
+
+
 class MetaNode(MetaEntity):
     """Creator of Node subclasses."""
+    # Node subclasses alive, by their labels.
+    registry: MutableMapping[FrozenSet[str], Type['Node']] = \
+        WeakValueDictionary()
+    # Best matching Node subclass by the labels of a neo4j node, weakly
+    # referenced like the registry, _NoMatch when none does.
+    _matches: MutableMapping[FrozenSet[str], Type] = WeakValueDictionary()
+
     def __new__(mcs: Type, name: str, bases: Tuple[Type, ...], attrs: dict):
         # Creation of the Node class.
         class Empty:
@@ -33,6 +85,9 @@ class MetaNode(MetaEntity):
         class AutoMeta:
             """Automatically constructed Meta."""
             labels = frozenset((name,))
+            primary_key = None
+            indexes = frozenset()
+            index_label = None
 
         class Meta(attrs.pop('Meta', Empty), AutoMeta):
             pass
@@ -40,9 +95,30 @@ class MetaNode(MetaEntity):
         if not isinstance(Meta.labels, frozenset):
             Meta.labels = frozenset(Meta.labels)
 
+        # The primary key is always indexed.
+        if Meta.primary_key is not None \
+                and not isinstance(Meta.primary_key, str) \
+                or isinstance(Meta.indexes, str) \
+                or not all(isinstance(prop, str) for prop in Meta.indexes):
+            raise BadIndexes(BadIndexes.__doc__)
+        Meta.indexes = frozenset(Meta.indexes).union(
+            (Meta.primary_key,) if Meta.primary_key else ()
+        )
+
+        # The label the indexes are declared on, required among several.
+        if Meta.index_label is None and len(Meta.labels) == 1:
+            Meta.index_label = next(iter(Meta.labels))
+        if Meta.indexes and Meta.index_label not in Meta.labels:
+            raise BadIndexes(BadIndexes.__doc__)
+
         cls = super().__new__(mcs, name, bases, attrs)
         cls._meta = Meta
 
+        # Node itself is not a candidate for inflation.
+        if any(isinstance(base, MetaNode) for base in bases):
+            MetaNode.registry[Meta.labels] = cls
+            MetaNode._matches.clear()
+
         return cls
 
     @property
@@ -50,27 +126,177 @@ class MetaNode(MetaEntity):
         """Return a tuple of labels"""
         return cls._meta.labels
 
+    @staticmethod
+    def best_match(labels: Iterable[str]) -> Optional[Type['Node']]:
+        """
+        Find the Node subclass to inflate a neo4j node with these labels.
+
+        Among the subclasses whose labels are all on the node, subclasses
+        are preferred to their bases (Airport to Airdrome), then the most
+        labels win. The answer is kept, so that inflation is a dict lookup
+        per row.
+        """
+        labels = frozenset(labels)
+        match = MetaNode._matches.get(labels)
+        if match is not None:
+            return None if match is _NoMatch else match
+
+        match = MetaNode.registry.get(labels)
+        if match is None:
+            candidates = [
+                cls for cls in MetaNode.registry.values()
+                if cls.labels <= labels
+            ]
+            best = [
+                cls for cls in candidates
+                if not any(
+                    other is not cls and issubclass(other, cls)
+                    for other in candidates
+                )
+            ]
+            match = max(best, key=lambda cls: len(cls.labels), default=None)
+        MetaNode._matches[labels] = _NoMatch if match is None else match
+
+        return match
+
 
 class MetaEdge(MetaEntity):
+    """Creator of Edge subclasses."""
+    # Edge subclasses alive, by their type.
+    registry: MutableMapping[str, Type['Edge']] = WeakValueDictionary()
+
+    def __new__(mcs: Type, name: str, bases: Tuple[Type, ...], attrs: dict):
+        # Creation of the Edge class.
+        class Empty:
+            """An empty class."""
+        class AutoMeta:
+            """Automatically constructed Meta."""
+            type = name.upper()
+
+        class Meta(attrs.pop('Meta', Empty), AutoMeta):
+            pass
+
+        if not isinstance(Meta.type, str) or not Meta.type:
+            raise BadType(BadType.__doc__)
+
+        cls = super().__new__(mcs, name, bases, attrs)
+        cls._meta = Meta
+
+        # Edge itself is not a candidate for inflation.
+        if any(isinstance(base, MetaEdge) for base in bases):
+            MetaEdge.registry[Meta.type] = cls
+
+        return cls
+
     @property
-    def type(cls):
-        raise NotImplementedError
+    def type(cls) -> str:
+        """Return the type"""
+        return cls._meta.type
 
 
 class Entity:
-    def inflate(self, entity: graph.Entity) -> 'Entity':
+    __slots__ = ('_id', '_changed', '_prefetched', '__weakref__')
+    # Statement matching the saved entity as `e` by an id expression.
+    _match = ''
+
+    def __init__(self):
+        # Internal id of the entity in the database, None if it is not saved.
+        self._id = None
+        # Names of the props changed since the inflation or the last save.
+        self._changed = frozenset()
+        # Related entities collected by Query.prefetch, by list name.
+        self._prefetched = None
+
+    def prefetched(self, into: str) -> List['Entity']:
+        """Return the related entities Query.prefetch collected `into`."""
+        if self._prefetched is None or into not in self._prefetched:
+            raise KeyError(into)
+        return self._prefetched[into]
+
+    def _attach(self, into: str, related: List['Entity']):
+        """Keep the related entities collected by Query.prefetch."""
+        if self._prefetched is None:
+            self._prefetched = {}
+        self._prefetched[into] = related
+
+    @classmethod
+    def inflate(cls, entity: graph.Entity) -> 'Entity':
+        """Build an instance from a neo4j entity, keeping declared props."""
+        instance = cls()
+        instance._id = entity.id
+        for (prop_name, value) in entity.items():
+            prop = cls._props.get(prop_name)
+            if prop is not None:
+                setattr(instance, prop.slot, value)
+
+        return instance
+
+    def _values(self, prop_names: Iterable[str]) -> Dict[str, Any]:
+        """Values of the props, by their name in the database."""
+        props = type(self)._props
+        return {
+            name: getattr(self, props[name].slot, None) for name in prop_names
+        }
+
+    def _set_values(self) -> Dict[str, Any]:
+        """Values of the props which are not null."""
+        values = self._values(type(self)._props)
+        return {
+            name: value for name, value in values.items() if value is not None
+        }
+
+    def _create(self) -> Tuple[str, Mapping[str, Any]]:
+        """Statement and params creating the entity, returning its id."""
         raise NotImplementedError
 
+    def _update(self) -> Tuple[str, Mapping[str, Any]]:
+        """Statement and params setting the changed props only."""
+        names = sorted(self._changed)
+        values = self._values(names)
+
+        params = {'id': self._id}
+        assignments = []
+        for (index, name) in enumerate(names):
+            params['p%d' % index] = values[name]
+            assignments.append('e.%s = $p%d' % (name, index))
+
+        statement = '%s\nSET %s' % (
+            self._match % '$id',
+            ', '.join(assignments),
+        )
+
+        return statement, params
+
+    def save(self, runner: Any):
+        """
+        Write the entity with the `runner`: a DB, a session or a transaction.
+
+        An unsaved entity is created with all its props. Otherwise, only the
+        props changed since the inflation or the last save are set, and
+        nothing is sent when none changed.
+        """
+        if self._id is None:
+            for record in runner.run(*self._create()):
+                self._id = record[0]
+        elif self._changed:
+            runner.run(*self._update())
+
+        self._changed = frozenset()
+
     def as_dict(self) -> Mapping[str, Any]:
         raise NotImplementedError
 
 
 class Node(Entity, metaclass=MetaNode):
-    def __init__(self):
-        self._meta = self._meta()
+    # Labels of the instance, only set when they differ from the class ones.
+    __slots__ = ('_labels',)
+    _match = 'MATCH (e) WHERE id(e) = %s'
 
     def _labels_getter(self) -> FrozenSet[str]:
-        return self._meta.labels
+        try:
+            return self._labels
+        except AttributeError:
+            return self._meta.labels
 
     def _labels_setter(self, value: Iterable[str]):
         exception_message = BadLabels.__doc__
@@ -89,7 +315,10 @@ class Node(Entity, metaclass=MetaNode):
         if not type(self).labels.issubset(labels):
             raise BadLabels(exception_message)
 
-        self._meta.labels = labels
+        if labels != type(self).labels:
+            self._labels = labels
+        elif hasattr(self, '_labels'):
+            del self._labels
 
     labels = DynamicClassAttribute(
         fget=_labels_getter,
@@ -98,22 +327,244 @@ class Node(Entity, metaclass=MetaNode):
 
     @classmethod
     def inflate(cls, node: graph.Node) -> 'Node':
-        raise NotImplementedError
-
-    def save(self):
-        raise NotImplementedError
+        """Build an instance from a neo4j node."""
+        instance = super().inflate(node)
+        # Extra labels are only stored when the node has some.
+        if node.labels != cls.labels:
+            instance.labels = node.labels
+
+        return instance
+
+    def _create(self) -> Tuple[str, Mapping[str, Any]]:
+        """Statement and params creating the node, returning its id."""
+        statement = 'CREATE (e:%s $props)\nRETURN id(e)' % ':'.join(
+            sorted(self.labels)
+        )
+
+        return statement, {'props': self._set_values()}
+
+    def _key_value(self) -> Any:
+        """Value of the primary key."""
+        primary_key = type(self)._meta.primary_key
+        return self._values((primary_key,))[primary_key]
+
+    def _merge_key(self) -> Any:
+        """Value of the primary key to MERGE on, which can not be null."""
+        value = self._key_value()
+        if value is None:
+            raise NullPrimaryKey(NullPrimaryKey.__doc__)
+        return value
+
+    def _merge_pattern(self, key: str) -> str:
+        """
+        MERGE clause on the primary key, its value being the `key`
+        expression, followed by the SET of the extra labels.
+        """
+        cls = type(self)
+        if cls._meta.primary_key is None:
+            raise NoPrimaryKey(NoPrimaryKey.__doc__)
+
+        pattern = 'MERGE (e:%s {%s: %s})' % (
+            ':'.join(sorted(cls.labels)),
+            cls._meta.primary_key,
+            key,
+        )
+        extra = self.labels - cls.labels
+        if extra:
+            pattern += '\nSET e:%s' % ':'.join(sorted(extra))
+
+        return pattern
+
+    def upsert(self, runner: Any):
+        """
+        Create the node, or update the node having the same primary key,
+        with the `runner`: a DB, a session or a transaction.
+
+        All the props of the node which are not null are written.
+        """
+        statement = '%s\nSET e += $props\nRETURN id(e)' % (
+            self._merge_pattern('$key')
+        )
+        params = {'key': self._merge_key(), 'props': self._set_values()}
+        for record in runner.run(statement, params):
+            self._id = record[0]
+
+        self._changed = frozenset()
+
+
+Endpoint = Union[Node, int, None]
 
 
 class Edge(Entity, metaclass=MetaEdge):
+    # Endpoints: nodes, or internal ids of the nodes of inflated edges which
+    # are loaded by `_endpoints` when first accessed.
+    __slots__ = ('_start', '_end', '_endpoints')
+    _match = 'MATCH ()-[e]->() WHERE id(e) = %s'
+
+    def __init__(self, start: Node = None, end: Node = None):
+        super().__init__()
+        self._start: Endpoint = start
+        self._end: Endpoint = end
+        self._endpoints: Optional[Endpoints] = None
+
     @classmethod
-    def inflate(cls, edge: graph.Relationship) -> 'Edge':
-        raise NotImplementedError
+    def inflate(
+            cls,
+            edge: graph.Relationship,
+            endpoints: 'Endpoints' = None,
+    ) -> 'Edge':
+        """
+        Build an instance from a neo4j relationship, its endpoints being
+        loaded in bulk by `endpoints` when first accessed.
+        """
+        instance = super().inflate(edge)
+        instance._start = edge.start_node.id
+        instance._end = edge.end_node.id
+        if endpoints is not None:
+            instance._endpoints = endpoints
+            endpoints.defer(instance._start)
+            endpoints.defer(instance._end)
+
+        return instance
+
+    @staticmethod
+    def _endpoint_id(endpoint: Endpoint) -> Optional[int]:
+        """Internal id of an endpoint, None if it is not saved."""
+        return endpoint._id if isinstance(endpoint, Node) else endpoint
+
+    def _create(self) -> Tuple[str, Mapping[str, Any]]:
+        """Statement and params creating the edge, returning its id."""
+        start = self._endpoint_id(self._start)
+        end = self._endpoint_id(self._end)
+        if start is None or end is None:
+            raise BadEndpoints(BadEndpoints.__doc__)
+
+        statement = (
+            'MATCH (s), (t) WHERE id(s) = $start AND id(t) = $end\n'
+            'CREATE (s)-[e:%s $props]->(t)\n'
+            'RETURN id(e)' % type(self).type
+        )
+
+        return statement, {
+            'start': start,
+            'end': end,
+            'props': self._set_values(),
+        }
+
+    def _resolve(self, endpoint: Endpoint) -> Optional[Node]:
+        """Turn the id of an endpoint into its node."""
+        if not isinstance(endpoint, int):
+            return endpoint
+        if self._endpoints is None:
+            raise Detached(Detached.__doc__)
+
+        return self._endpoints.get(endpoint)
 
     def start_node(self) -> Node:
-        raise NotImplementedError
+        """The start node, loaded with all the pending endpoints."""
+        self._start = self._resolve(self._start)
+        return self._start
 
     def end_node(self) -> Node:
-        raise NotImplementedError
-
-    def save(self):
-        raise NotImplementedError
+        """The end node, loaded with all the pending endpoints."""
+        self._end = self._resolve(self._end)
+        return self._end
+
+
+def inflate(value: Any, endpoints: 'Endpoints' = None) -> Any:
+    """
+    Inflate neo4j nodes and relationships of a result value into the best
+    matching Node and Edge subclasses.
+
+    Lists are inflated item by item, entities matching no subclass and other
+    values are returned as they are. With `endpoints`, entities are shared
+    through its identity maps and edges load their endpoints through it.
+    """
+    if isinstance(value, graph.Node):
+        if endpoints is not None and value.id in endpoints.nodes:
+            return endpoints.nodes[value.id]
+        cls = MetaNode.best_match(value.labels)
+        node = value if cls is None else cls.inflate(value)
+        if endpoints is not None:
+            endpoints.remember(value.id, node)
+        return node
+    if isinstance(value, graph.Relationship):
+        if endpoints is not None and value.id in endpoints.edges:
+            return endpoints.edges[value.id]
+        cls = MetaEdge.registry.get(value.type)
+        edge = value if cls is None else cls.inflate(value, endpoints)
+        if endpoints is not None:
+            endpoints.remember(value.id, edge)
+        return edge
+    if isinstance(value, list):
+        return [inflate(item, endpoints) for item in value]
+
+    return value
+
+
+class Endpoints:
+    """
+    Loader of the endpoints of inflated edges, sharing the entities through
+    identity maps by internal id.
+
+    The first access to an endpoint loads all the pending ones with a single
+    query run by the `runner`: a DB, a session or a transaction.
+
+        endpoints = Endpoints(db)
+        for (flight,) in db.stream(query, inflate=endpoints.inflate):
+            flight.start_node()
+    """
+    def __init__(
+            self,
+            runner: Any,
+            nodes: MutableMapping[int, Optional[Node]] = None,
+    ):
+        self.runner = runner
+        # Nodes by internal id, None for the deleted ones.
+        self.nodes: MutableMapping[int, Optional[Node]] = (
+            {} if nodes is None else nodes
+        )
+        # Edges by internal id.
+        self.edges: Dict[int, Edge] = {}
+        self._pending: Set[int] = set()
+
+    def inflate(self, value: Any) -> Any:
+        """Inflate a result value, see `inflate`."""
+        return inflate(value, self)
+
+    def remember(self, entity_id: int, entity: Any):
+        """Add an inflated node or edge to the identity maps."""
+        if isinstance(entity, (Edge, graph.Relationship)):
+            self.edges[entity_id] = entity
+        else:
+            self.nodes[entity_id] = entity
+
+    def defer(self, node_id: int):
+        """Load the node with the next batch, unless it is known."""
+        if node_id not in self.nodes:
+            self._pending.add(node_id)
+
+    def get(self, node_id: int) -> Optional[Node]:
+        """Return the node, loading it with all the pending ones if needed."""
+        if node_id not in self.nodes:
+            self._pending.add(node_id)
+            self.load()
+
+        return self.nodes[node_id]
+
+    def load(self):
+        """Load all the pending nodes with a single query."""
+        ids = sorted(self._pending.difference(self.nodes))
+        self._pending.clear()
+        if not ids:
+            return
+
+        records = self.runner.run(
+            'MATCH (n) WHERE id(n) IN $ids\nRETURN n',
+            {'ids': ids},
+        )
+        for record in records:
+            inflate(record[0], self)
+        # Deleted nodes are not looked for again.
+        for node_id in ids:
+            self.nodes.setdefault(node_id, None)
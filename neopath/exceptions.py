@@ -4,3 +4,30 @@ class NeopathException(Exception):
 
 class BadLabels(NeopathException):
     """`labels` should be an iterable of nonempty strings."""
+
+
+class BadIndexes(NeopathException):
+    """
+    `primary_key` should be a string, `indexes` an iterable of strings and
+    `index_label` one of the labels, given if there are several.
+    """
+
+
+class BadType(NeopathException):
+    """`type` should be a nonempty string."""
+
+
+class BadEndpoints(NeopathException):
+    """Both endpoints of an edge should be saved nodes."""
+
+
+class NoPrimaryKey(NeopathException):
+    """Upserted nodes should declare a `primary_key` in their Meta."""
+
+
+class NullPrimaryKey(NeopathException):
+    """Upserted nodes should have a value for their primary key."""
+
+
+class Detached(NeopathException):
+    """The entity can not load related entities without a runner."""
@@ -1,4 +1,4 @@
-from typing import Union
+from typing import Any, FrozenSet, Iterable, Tuple, Union
 
 
 class BitwiseMixin:
@@ -41,3 +41,268 @@ class Xor(Logic):
 class Not(Logic):
     """Helper class for ~ operation"""
     pass
+
+
+# Canonical terms of the optimiser, all of them hashable:
+# ('and', labels and other leaves, other terms) - a conjunction,
+# ('or', terms), ('xor', terms), ('not', term), TRUE and FALSE.
+Term = tuple
+TRUE = ('true',)
+FALSE = ('false',)
+
+
+def _conjunction(term: Term) -> Term:
+    """View a term as a conjunction."""
+    if term[0] == 'and':
+        return term
+    return 'and', frozenset(), frozenset((term,))
+
+
+def _implies(conjunction: Term, term: Term) -> bool:
+    """Check, without expanding, that the conjunction implies the term."""
+    _, leaves, others = _conjunction(term)
+    return leaves <= conjunction[1] and others <= conjunction[2]
+
+
+def _and(terms: Iterable[Term]) -> Term:
+    """Build a simplified conjunction."""
+    leaves, others = set(), set()
+    for term in terms:
+        if term == FALSE:
+            return FALSE
+        if term == TRUE:
+            continue
+        if term[0] == 'and':
+            leaves.update(term[1])
+            others.update(term[2])
+        else:
+            others.add(term)
+
+    conjunction = ('and', frozenset(leaves), frozenset(others))
+    for term in others:
+        # Contradiction: A & ~A.
+        if term[0] == 'not' and _implies(conjunction, term[1]):
+            return FALSE
+    for term in list(others):
+        # Absorption: A & (A | B) is A.
+        rest = ('and', conjunction[1], frozenset(others - {term}))
+        if term[0] == 'or' and any(_implies(rest, item) for item in term[1]):
+            others.remove(term)
+
+    if not leaves and len(others) == 1:
+        return others.pop()
+    if not leaves and not others:
+        return TRUE
+    return 'and', frozenset(leaves), frozenset(others)
+
+
+def _or(terms: Iterable[Term]) -> Term:
+    """Build a simplified disjunction."""
+    disjuncts = set()
+    for term in terms:
+        if term == TRUE:
+            return TRUE
+        if term == FALSE:
+            continue
+        if term[0] == 'or':
+            disjuncts.update(term[1])
+        else:
+            disjuncts.add(term)
+
+    for term in disjuncts:
+        # Tautology: A | ~A.
+        if ('not', term) in disjuncts:
+            return TRUE
+    # Absorption: A | (A & B) is A.
+    disjuncts = {
+        term for term in disjuncts
+        if not any(
+            other != term and _implies(_conjunction(term), other)
+            for other in disjuncts
+        )
+    }
+
+    if len(disjuncts) == 1:
+        return disjuncts.pop()
+    if not disjuncts:
+        return FALSE
+    return 'or', frozenset(disjuncts)
+
+
+def _not(term: Term) -> Term:
+    """Build a simplified negation."""
+    if term == TRUE:
+        return FALSE
+    if term == FALSE:
+        return TRUE
+    if term[0] == 'not':
+        return term[1]
+    return 'not', term
+
+
+def _xor(terms: Iterable[Term]) -> Term:
+    """Build a simplified exclusive disjunction."""
+    negated = False
+    odd = []
+    for term in terms:
+        if term == TRUE:
+            negated = not negated
+        elif term == FALSE:
+            continue
+        elif term in odd:
+            # A ^ A is false.
+            odd.remove(term)
+        else:
+            odd.append(term)
+
+    if not odd:
+        term = FALSE
+    elif len(odd) == 1:
+        term = odd[0]
+    else:
+        term = 'xor', tuple(odd)
+
+    return _not(term) if negated else term
+
+
+def _term(expression: Any) -> Term:
+    """Build the simplified term of an expression."""
+    if isinstance(expression, And):
+        return _and(map(_term, expression))
+    if isinstance(expression, Or):
+        return _or(map(_term, expression))
+    if isinstance(expression, Xor):
+        return _xor(map(_term, expression))
+    if isinstance(expression, Not):
+        return _not(_and(map(_term, expression)))
+
+    # Node classes stand for all their labels.
+    labels = getattr(expression, 'labels', None)
+    if isinstance(labels, frozenset):
+        return _and(('and', frozenset((label,)), frozenset())
+                    for label in labels)
+
+    return 'and', frozenset((expression,)), frozenset()
+
+
+def _sort_key(item: Any) -> Tuple[bool, str]:
+    """Sort labels first, then the other leaves and terms."""
+    return not isinstance(item, str), str(item)
+
+
+def _expression(term: Term) -> Any:
+    """Turn a term back into an expression."""
+    if term == TRUE:
+        return And()
+    if term == FALSE:
+        return Or()
+    if term[0] == 'and':
+        items = sorted(term[1], key=_sort_key) + sorted(
+            map(_expression, term[2]), key=_sort_key,
+        )
+        return items[0] if len(items) == 1 else And(*items)
+    if term[0] == 'or':
+        return Or(*sorted(map(_expression, term[1]), key=_sort_key))
+    if term[0] == 'xor':
+        return Xor(*map(_expression, term[1]))
+    return Not(_expression(term[1]))
+
+
+def optimize(expression: Any) -> Any:
+    """
+    Simplify a logical expression.
+
+    Nested operations of the same kind are flattened, absorbed terms are
+    removed, `A & (A | B)` and `A | (A & B)` become `A`, contradictions
+    become `Or()` (false) and tautologies `And()` (true).
+    """
+    return _expression(_term(expression))
+
+
+def _hoist(term: Term) -> Tuple[FrozenSet[str], Term]:
+    """Split the labels every match has from the rest of the term."""
+    if term[0] == 'and':
+        labels = frozenset(
+            leaf for leaf in term[1] if isinstance(leaf, str)
+        )
+        return labels, _and((('and', term[1] - labels, term[2]),))
+    if term[0] == 'or':
+        conjunctions = [_conjunction(item) for item in term[1]]
+        labels = frozenset.intersection(*(
+            frozenset(leaf for leaf in leaves if isinstance(leaf, str))
+            for _, leaves, _others in conjunctions
+        ))
+        return labels, _or(
+            _and((('and', leaves - labels, others),))
+            for _, leaves, others in conjunctions
+        )
+
+    return frozenset(), term
+
+
+def _where(term: Term) -> str:
+    """Build the WHERE template of a term, `{0}` being the variable."""
+    def nested(item: Term) -> str:
+        where = _where(item)
+        if item[0] in ('or', 'xor') or ' AND ' in where:
+            return '(' + where + ')'
+        return where
+
+    if term == TRUE:
+        return 'true'
+    if term == FALSE:
+        return 'false'
+    if term[0] == 'and':
+        parts = []
+        labels = sorted(leaf for leaf in term[1] if isinstance(leaf, str))
+        if labels:
+            parts.append('{0}:' + ':'.join(labels))
+        parts.extend(sorted(
+            str(leaf) for leaf in term[1] if not isinstance(leaf, str)
+        ))
+        parts.extend(sorted(map(nested, term[2])))
+        return ' AND '.join(parts)
+    if term[0] == 'or':
+        return ' OR '.join(sorted(map(nested, term[1])))
+    if term[0] == 'xor':
+        return ' XOR '.join(map(nested, term[1]))
+    return 'NOT ' + nested(term[1])
+
+
+def inline_and_where(expression: Any) -> Tuple[str, str]:
+    """
+    Optimise a label expression of a node and split it into the labels
+    every matching node has, to be inlined into the pattern so that Neo4j
+    starts with a label scan, and the remaining WHERE template, `{0}`
+    standing for the variable of the node. Disjunctions are parenthesised
+    to be safely joined with other conditions:
+
+        (Hub & Airport) | (Hub & BusStation)
+        ':Hub', '({0}:Airport OR {0}:BusStation)'
+    """
+    labels, rest = _hoist(_term(expression))
+    inline = ''.join(':' + label for label in sorted(labels))
+    if rest == TRUE:
+        return inline, ''
+    if rest[0] in ('or', 'xor'):
+        return inline, '(' + _where(rest) + ')'
+
+    return inline, _where(rest)
+
+
+def label_branches(expression: Any) -> Tuple[Tuple[str, ...], ...]:
+    """
+    Split an optimised label expression of a node into the labels of each
+    branch of a disjunction, e.g. `(A & B) | C` into `(('A', 'B'), ('C',))`.
+
+    Return an empty tuple unless the expression is a disjunction of labels.
+    """
+    term = _term(expression)
+    if term[0] != 'or' or any(
+            item[0] != 'and' or item[2]
+            or not all(isinstance(leaf, str) for leaf in item[1])
+            for item in term[1]
+    ):
+        return ()
+
+    return tuple(sorted(tuple(sorted(item[1])) for item in term[1]))
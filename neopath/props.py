@@ -1,6 +1,24 @@
+from typing import Any
+
 from . import comparisons
 
 
+def same(old: Any, value: Any) -> bool:
+    """
+    Check that the values are equal and of the same types, down to the
+    items of lists and maps, `1` and `True` or `1.0` being saved differently.
+    """
+    if type(old) is not type(value):
+        return False
+    if isinstance(value, (list, tuple)):
+        return len(old) == len(value) and all(map(same, old, value))
+    if isinstance(value, dict):
+        return old.keys() == value.keys() and all(
+            same(old[key], item) for key, item in value.items()
+        )
+    return old == value
+
+
 class Prop:
     comparable = comparisons.ComparableProp
 
@@ -11,6 +29,31 @@ class Prop:
     ):
         self.entity = None
         self.prop_name = prop_name
+        # Name of the instance slot holding the value, set by MetaEntity.
+        self.slot = None
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        # A prop missing on a neo4j entity is null.
+        return getattr(instance, self.slot, None)
+
+    def __set__(self, instance, value):
+        if hasattr(instance, self.slot) \
+                and same(getattr(instance, self.slot), value):
+            return
+        setattr(instance, self.slot, value)
+        self._record_change(instance)
+
+    def __delete__(self, instance):
+        delattr(instance, self.slot)
+        self._record_change(instance)
+
+    def _record_change(self, instance):
+        """Mark the prop as changed, if the instance tracks changes."""
+        changed = getattr(instance, '_changed', None)
+        if changed is not None:
+            instance._changed = changed | {self.prop_name}
 
     def __call__(self, var: str) -> comparable:
         raise NotImplementedError
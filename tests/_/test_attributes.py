@@ -3,7 +3,7 @@ from unittest import TestCase
 
 from neo4j.types import INT64_MAX, INT64_MIN
 
-from neopath import attributes, entities
+from neopath._ import attributes, entities
 
 
 class AttrTests(TestCase):
@@ -75,6 +75,24 @@ class AttrTests(TestCase):
         self.assertEqual(comparison.operator, '<>')
         self.assertEqual(comparison.other, 2)
 
+    def test___call__(self):
+        """Calling an attribute should bind it to a variable"""
+        attr = attributes.AnyAttr(prop_name='attr')
+        bound = attr('a')
+
+        self.assertIs(bound.attribute, attr)
+        self.assertEqual(bound.var, 'a')
+
+    def test_ordering(self):
+        """Test the __lt__, __le__, __gt__ and __ge__ methods"""
+        attr = attributes.AnyAttr(prop_name='attr')
+        comparisons = (attr < 2, attr <= 2, attr > 2, attr >= 2)
+
+        for comparison, operator in zip(comparisons, ('<', '<=', '>', '>=')):
+            self.assertIs(comparison.attribute, attr)
+            self.assertEqual(comparison.operator, operator)
+            self.assertEqual(comparison.other, 2)
+
 
 class AnyAttrTests(TestCase):
     """Tests for AnyAttr"""
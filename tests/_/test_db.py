@@ -1,11 +1,414 @@
 """Tests for neopath.db"""
+import asyncio
+from threading import Thread
 from unittest import TestCase
 
-from neopath.db import DB
+from neo4j.exceptions import ServiceUnavailable
+from neo4j.types.graph import Graph
+
+from neopath import entities, props
+from neopath.exceptions import BadEndpoints
+from neopath._ import attributes
+from neopath._.db import AsyncDB, DB, Session, SessionExpired
+from neopath._.entities import Node
+from neopath._.query import Query, Slot
+
+
+class Result(list):
+    """Fake neo4j result"""
+    def consume(self):
+        """Discard the records"""
+        self.clear()
+
+
+class Connection:
+    """Fake bolt connection"""
+    def __init__(self):
+        self.reset_count = 0
+
+    def reset(self):
+        """Interrupt the running statement"""
+        self.reset_count += 1
+
+
+class Transaction:
+    """Fake neo4j transaction, committed on a clean exit"""
+    def __init__(self, session):
+        self.session = session
+        self.committed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_exc_info):
+        self.committed = exc_type is None
+
+    def run(self, statement, parameters=None):
+        """Run the statement in the session"""
+        return self.session.run(statement, parameters)
+
+
+class DriverSession:
+    """Fake neo4j session recording the statements"""
+    def __init__(self, driver, config):
+        self.driver = driver
+        self.config = config
+        self.closed = False
+        self.transaction = None
+        self._connection = Connection()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc_info):
+        self.close()
+
+    def run(self, statement, parameters=None):
+        """Record the statement and return the prepared records"""
+        if statement == 'RETURN 1' and self.driver.dead:
+            self.driver.dead -= 1
+            raise self.driver.error('dead connection')
+        self.driver.statements.append((statement, parameters))
+        return Result(self.driver.records)
+
+    def begin_transaction(self):
+        """Open a fake transaction"""
+        self.transaction = Transaction(self)
+        return self.transaction
+
+    def close(self):
+        """Close the session"""
+        self.closed = True
+
+
+class Driver:
+    """Fake neo4j driver"""
+    def __init__(self, records=(), dead=0, error=ServiceUnavailable):
+        self.records = list(records)
+        self.dead = dead
+        self.error = error
+        self.statements = []
+        self.sessions = []
+        self.closed = False
+
+    def session(self, _access_mode=None, **config):
+        """Open a fake session"""
+        session = DriverSession(self, config)
+        self.sessions.append(session)
+        return session
+
+    def close(self):
+        """Close the driver"""
+        self.closed = True
+
+
+class SomeNode(Node):
+    """Node example"""
+    attr = attributes.AnyAttr()
 
 
 class DBTests(TestCase):
-    """Sample tests"""
-    def test_match(self):
-        """Test example"""
-        self.assertIs(DB, DB)
+    """DB tests"""
+    def test_run(self):
+        """A Query should be compiled once and its records decoded"""
+        driver = Driver(records=[('a', 1), ('b', 2)])
+        db = DB(driver=driver)
+        query = (Query()
+                 .match(SomeNode, 'n')
+                 .where(SomeNode.attr != 1)
+                 .returning(SomeNode.attr('n'))
+                 )
+
+        self.assertEqual(db.run(query), [('a', 1), ('b', 2)])
+        self.assertEqual(driver.statements, [query.compile()])
+        self.assertTrue(all(session.closed for session in driver.sessions))
+
+        template = Query().match(SomeNode).where(
+            SomeNode.attr != Slot('value'),
+        ).prepare()
+        db.run(template, {'value': 3})
+        self.assertEqual(driver.statements[-1], (template.cypher, {'a': 3}))
+
+        db.run('RETURN $x', {'x': 1})
+        self.assertEqual(driver.statements[-1], ('RETURN $x', {'x': 1}))
+
+        with db:
+            pass
+        self.assertTrue(driver.closed)
+
+    def test_liveness_check(self):
+        """An idle DB should check the connection before using it"""
+        driver = Driver(dead=1)
+        db = DB(driver=driver, liveness_check_timeout=0)
+
+        db.run('RETURN 2')
+
+        self.assertEqual(db.stats().liveness_checks, 1)
+        self.assertEqual(len(driver.sessions), 2)
+        self.assertEqual(driver.statements, [('RETURN 2', {})])
+
+        # Routing drivers report a dead connection as an expired session.
+        driver = Driver(dead=1, error=SessionExpired)
+        db = DB(driver=driver, liveness_check_timeout=0)
+        db.run('RETURN 2')
+        self.assertEqual(len(driver.sessions), 2)
+        self.assertEqual(driver.statements, [('RETURN 2', {})])
+
+    def test_stats(self):
+        """Sessions should be accounted for across threads"""
+        db = DB(driver=Driver(), max_pool_size=10)
+
+        with db.session():
+            with db.session():
+                stats = db.stats()
+        self.assertEqual(stats.sessions, 2)
+        self.assertEqual(stats.max_size, 10)
+
+        threads = [Thread(target=db.run, args=('RETURN 1',)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = db.stats()
+        self.assertEqual(stats.sessions, 0)
+        self.assertEqual(stats.acquired, 10)
+        self.assertGreaterEqual(stats.peak_sessions, 2)
+
+    def test_save_many(self):
+        """Entities should be saved with one statement per chunk"""
+        class Airport(entities.Node):
+            """Node example"""
+            name = props.Prop()
+
+        driver = Driver()
+        db = DB(driver=driver)
+        airports = [Airport() for _ in range(5)]
+        for airport in airports:
+            airport.name = 'A'
+
+        db.save_many(airports, chunk_size=2)
+
+        self.assertEqual(
+            [len(params['rows']) for _, params in driver.statements],
+            [2, 2, 1],
+        )
+        self.assertEqual(len(driver.sessions), 3)
+
+    def test_upsert_many(self):
+        """Nodes should be merged in chunks"""
+        class Airport(entities.Node):
+            """Node example"""
+            class Meta:
+                """Primary key of the node"""
+                primary_key = 'iata'
+            iata = props.Prop()
+
+        driver = Driver()
+        airports = [Airport() for _ in range(3)]
+        for (index, airport) in enumerate(airports):
+            airport.iata = str(index)
+
+        DB(driver=driver).upsert_many(iter(airports), chunk_size=2)
+
+        self.assertEqual(
+            [len(params['rows']) for _, params in driver.statements],
+            [2, 1],
+        )
+        self.assertTrue(driver.statements[0][0].startswith('UNWIND'))
+
+    def test_stream(self):
+        """Records should be inflated when consumed, the rest discarded"""
+        driver = Driver(records=[(i, -i) for i in range(5)])
+        db = DB(driver=driver)
+        inflated = []
+
+        def inflate(value):
+            inflated.append(value)
+            return str(value)
+
+        rows = db.stream('RETURN 1', inflate=inflate, fetch_size=2)
+        self.assertEqual(next(rows), ('0', '0'))
+        self.assertEqual(next(rows), ('1', '-1'))
+        self.assertEqual(inflated, [0, 0, 1, -1])
+        rows.close()
+
+        session = driver.sessions[-1]
+        self.assertEqual(session.config, {'fetch_size': 2})
+        self.assertEqual(session._connection.reset_count, 1)
+        self.assertTrue(session.closed)
+
+        self.assertEqual(len(list(db.stream('RETURN 1'))), 5)
+        self.assertEqual(driver.sessions[-1]._connection.reset_count, 0)
+        self.assertEqual(db.stats().sessions, 0)
+
+
+class SessionTests(TestCase):
+    """Session tests"""
+    def test_identity_map(self):
+        """Nodes should be inflated once and their changes written in bulk"""
+        class Hub(entities.Node):
+            """Node example"""
+            class Meta:
+                """Primary key of the node"""
+                primary_key = 'iata'
+            iata = props.Prop()
+            name = props.Prop()
+
+        graph = Graph()
+        orly = graph.put_node(1, ('Hub',), {'iata': 'ORY', 'name': 'orly'})
+        driver = Driver(records=[(orly,), (orly,)])
+
+        with Session(DB(driver=driver)) as session:
+            first, second = session.run('MATCH (e:Hub) RETURN e')
+            self.assertIsInstance(first[0], Hub)
+            self.assertIs(first[0], second[0])
+            self.assertIs(session.run('MATCH (e) RETURN e')[0][0], first[0])
+            self.assertIs(session.get(Hub, 'ORY'), first[0])
+            self.assertEqual(len(driver.statements), 2)
+
+            first[0].name = 'Orly'
+            new = Hub()
+            new.iata = 'CDG'
+            session.add(new)
+            driver.records = []
+
+        statements = driver.statements[2:]
+        self.assertEqual(len(statements), 2)
+        self.assertIn('CREATE (e:Hub)', statements[0][0])
+        self.assertEqual(statements[1][1], {'rows': [[1, 'Orly']]})
+        self.assertEqual(first[0]._changed, frozenset())
+        self.assertTrue(driver.sessions[-1].transaction.committed)
+
+        self.assertIsNone(session.get(Hub, 'LHR'))
+        self.assertEqual(driver.statements[-1], (
+            'MATCH (e:Hub {iata: $key})\nRETURN e\nLIMIT 1',
+            {'key': 'LHR'},
+        ))
+
+    def test_subclass_keys(self):
+        """Subclass nodes should be found by the class of their primary key"""
+        class Gate(entities.Node):
+            """Node example"""
+            class Meta:
+                """Primary key of the node"""
+                primary_key = 'code'
+            code = props.Prop()
+
+        class Jetway(Gate):
+            """Node example"""
+            class Meta:
+                """Labels and primary key of the node"""
+                labels = ('Gate', 'Jetway')
+                primary_key = 'code'
+                index_label = 'Gate'
+
+        graph = Graph()
+        jetway = graph.put_node(1, ('Gate', 'Jetway'), {'code': 'J1'})
+        gate = graph.put_node(2, ('Gate',), {'code': 'G1'})
+        driver = Driver(records=[(jetway,), (gate,)])
+        session = Session(DB(driver=driver))
+
+        first, second = session.run('MATCH (e:Gate) RETURN e')
+        self.assertIsInstance(first[0], Jetway)
+        self.assertIs(session.get(Gate, 'J1'), first[0])
+        self.assertIs(session.get(Jetway, 'J1'), first[0])
+        self.assertIs(session.get(Gate, 'G1'), second[0])
+        self.assertEqual(len(driver.statements), 1)
+
+        # A Gate is not a Jetway, the database is asked for one.
+        driver.records = []
+        self.assertIsNone(session.get(Jetway, 'G1'))
+        self.assertEqual(driver.statements[-1], (
+            'MATCH (e:Gate:Jetway {code: $key})\nRETURN e\nLIMIT 1',
+            {'key': 'G1'},
+        ))
+
+    def test_failed_commit(self):
+        """A failed commit should be rolled back and keep the entity states"""
+        class Pier(entities.Node):
+            """Node example"""
+            name = props.Prop()
+
+        graph = Graph()
+        driver = Driver(records=[
+            (graph.put_node(1, ('Pier',), {'name': 'north'}),),
+        ])
+        session = Session(DB(driver=driver))
+        (pier,), = session.run('MATCH (e:Pier) RETURN e')
+        pier.name = 'North'
+        session.add(Pier())
+        session.add(entities.Edge(pier, None))
+        driver.records = [(0, 2)]
+        count = len(driver.statements)
+
+        with self.assertRaises(BadEndpoints):
+            session.commit()
+        self.assertFalse(driver.sessions[-1].transaction.committed)
+        self.assertEqual(pier._changed, {'name'})
+        self.assertEqual(pier._id, 1)
+        self.assertEqual(len(session._added), 2)
+        self.assertTrue(all(
+            entity._id is None for entity in session._added.values()
+        ))
+
+        # Once the faulty edge is dropped, the commit goes through.
+        session._added = {
+            key: entity for key, entity in session._added.items()
+            if isinstance(entity, Pier)
+        }
+        session.commit()
+        self.assertTrue(driver.sessions[-1].transaction.committed)
+        self.assertEqual(pier._changed, frozenset())
+        self.assertEqual(session._added, {})
+        self.assertGreater(len(driver.statements), count)
+
+
+class AsyncDBTests(TestCase):
+    """AsyncDB tests"""
+    @staticmethod
+    def run_async(coroutine):
+        """Run a coroutine in a fresh event loop"""
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def test_fetch(self):
+        """Records should be fetched in batches from worker threads"""
+        driver = Driver(records=[(i,) for i in range(5)])
+        db = AsyncDB(db=DB(driver=driver), batch_size=2)
+        query = Query().match(SomeNode, 'n').count()
+
+        self.assertEqual(self.run_async(db.fetch(query)), [0, 1, 2, 3, 4])
+        self.assertEqual(self.run_async(db.fetch_one(query)), 0)
+        self.assertEqual(driver.statements[-1], query.compile())
+        self.assertTrue(all(session.closed for session in driver.sessions))
+        self.assertEqual(db.db.stats().sessions, 0)
+
+        # Stopping early interrupts the statement, like DB.stream.
+        self.assertEqual(driver.sessions[-1]._connection.reset_count, 1)
+        self.run_async(db.fetch(query))
+        self.assertEqual(driver.sessions[-1]._connection.reset_count, 0)
+
+        driver.records = []
+        self.assertIsNone(self.run_async(db.fetch_one('RETURN 1')))
+        self.assertEqual(driver.sessions[-1]._connection.reset_count, 0)
+
+        self.run_async(db.close())
+        self.assertTrue(driver.closed)
+
+    def test_concurrency(self):
+        """No more than `concurrency` queries should run at the same time"""
+        db = AsyncDB(db=DB(driver=Driver(records=[(1,)])), concurrency=2)
+
+        async def fetch_many():
+            return await asyncio.gather(*(
+                db.fetch('RETURN 1') for _ in range(10)
+            ))
+
+        self.assertEqual(self.run_async(fetch_many()), [[(1,)]] * 10)
+        stats = db.db.stats()
+        self.assertEqual(stats.acquired, 10)
+        self.assertLessEqual(stats.peak_sessions, 2)
@@ -1,8 +1,8 @@
 """Tests for neopath.entities"""
 from unittest import TestCase
 
-from neopath import exceptions
-from neopath.entities import Edge, Node, And, Or, Xor
+from neopath._ import exceptions
+from neopath._.entities import Edge, Node, And, Or, Xor, inline_and_where
 
 
 class LogicTests(TestCase):
@@ -160,6 +160,24 @@ class LogicTests(TestCase):
         self.assertEqual(inline, expected_inline)
         self.assertEqual(where, expected_where)
 
+    def test_inline_and_where(self):
+        """Label expressions of nodes are optimised before splitting"""
+        class A(Node):  # pylint: disable=invalid-name
+            """Node example"""
+            class Neo:
+                """Neo with labels"""
+                labels = ('A', 'B')
+
+        self.assertEqual(inline_and_where(A, True), (':A:B', ''))
+        self.assertEqual(inline_and_where(A | (A & 'C'), True), (':A:B', ''))
+        self.assertEqual(
+            inline_and_where((A & 'C') | And('A', Xor('D', 'E')), True),
+            (':A', '(({0}:D XOR {0}:E) OR {0}:B:C)'),
+        )
+        self.assertEqual(inline_and_where(Or('R', 'S'), False), (':R|:S', ''))
+        with self.assertRaises(exceptions.MultipleEdgeTypes):
+            inline_and_where(And('R', 'S'), False)
+
 
 class NodeNeoTests(TestCase):
     """Tests for Node.neo"""
@@ -227,6 +245,37 @@ class NodeNeoTests(TestCase):
                     """Neo class with bad labels"""
                     labels = ()
 
+    def test_neo_indexes(self):
+        """Property `neo` should record the indexed properties"""
+        class OneNode(Node):
+            """Node with no indexes"""
+
+        self.assertIsNone(OneNode.neo.primary_key)
+        self.assertEqual(OneNode.neo.indexes, frozenset())
+        self.assertEqual(OneNode.neo.index_label, 'OneNode')
+
+        class TwoNode(Node):
+            """Node with a primary key and indexes"""
+            class Neo:
+                """Neo class with indexes"""
+                labels = ('Two', 'Node')
+                primary_key = 'uid'
+                indexes = ('name',)
+                index_label = 'Two'
+
+        self.assertEqual(TwoNode.neo.primary_key, 'uid')
+        self.assertEqual(TwoNode.neo.indexes, {'uid', 'name'})
+        self.assertEqual(TwoNode.neo.index_label, 'Two')
+
+        for neo in (
+                {'primary_key': 1},
+                {'indexes': 'name'},
+                {'indexes': (None,)},
+                {'index_label': 'Unknown'},
+        ):
+            with self.assertRaises(exceptions.BadIndexes):
+                type('BadNode', (Node,), {'Neo': type('Neo', (), neo)})
+
 
 class EdgeNeoTests(TestCase):
     """Tests for Edge.neo"""
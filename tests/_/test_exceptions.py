@@ -1,7 +1,7 @@
 """Tests for neopath.exceptions"""
 from unittest import TestCase
 
-from neopath.exceptions import NeopathException
+from neopath._.exceptions import NeopathException
 
 
 class ExceptionsTests(TestCase):
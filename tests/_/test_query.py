@@ -1,9 +1,18 @@
 """Tests for neopath.query"""
 from unittest import TestCase
 
-from neopath import attributes, exceptions
-from neopath.entities import Edge, Node
-from neopath.query import Query, vars_generator
+from neopath import entities
+from neopath._ import attributes, exceptions
+from neopath._.entities import Edge, Node
+from neopath._.query import (
+    CACHE,
+    Chain,
+    Aggregate,
+    CompiledCache,
+    Query,
+    Slot,
+    vars_generator,
+)
 
 
 class Tests(TestCase):
@@ -25,6 +34,23 @@ class Tests(TestCase):
         self.assertEqual(next(iterator), 'aa')
 
 
+class ChainTests(TestCase):
+    """Chain tests"""
+    def test_append_and_extend(self):
+        """New chains should share the prefix and leave the old ones intact"""
+        base = Chain((1, 2))
+        first = base.append(3)
+        second = first.extend((4, 5))
+        branch = first.append('other')
+
+        self.assertEqual(base.items(), (1, 2))
+        self.assertEqual(first.items(), (1, 2, 3))
+        self.assertEqual(tuple(second), (1, 2, 3, 4, 5))
+        self.assertEqual(branch.items(), (1, 2, 3, 'other'))
+        self.assertEqual(len(second), 5)
+        self.assertFalse(Chain())
+
+
 class QueryTests(TestCase):
     """Query tests"""
     def test_simple_match(self):
@@ -82,6 +108,132 @@ class QueryTests(TestCase):
         ))
         self.assertEqual(str(query), expected)
 
+    def test_match_with_logic(self):
+        """Label expressions are optimised, shared labels stay inline"""
+        class Hub(Node):
+            """Node example"""
+
+        class Airport(Node):
+            """Node example"""
+
+        query = Query().match((Hub & Airport) | (Hub & 'Port'), 'h')
+        expected = '\n'.join((
+            'MATCH (h:Hub)',
+            'WHERE (h:Airport OR h:Port)',
+            'RETURN h',
+        ))
+        self.assertEqual(str(query), expected)
+
+        query = Query().match(Hub & (Hub | Airport)).where('_a.x = 1')
+        expected = '\n'.join((
+            'MATCH (_a:Hub)',
+            'WHERE _a.x = 1',
+            'RETURN _a',
+        ))
+        self.assertEqual(str(query), expected)
+
+        query = (Query()
+                 .match('A', 'a')
+                 .connected_through(Edge | 'KNOWS')
+                 .to(Hub | Airport, 'b')
+                 )
+        expected = '\n'.join((
+            'MATCH (a:A)-[_a:EDGE|:KNOWS]->(b)',
+            'WHERE (b:Airport OR b:Hub)',
+            'RETURN _a, a, b',
+        ))
+        self.assertEqual(str(query), expected)
+
+        # Label filters keep their meaning next to other conditions.
+        for identifier, where in (
+                (Hub | Airport, '(h:Airport OR h:Hub)'),
+                ((Hub & Airport) | (Hub & 'Port'), '(h:Airport OR h:Port)'),
+                (Hub ^ Airport, '(h:Hub XOR h:Airport)'),
+        ):
+            query = Query().match(identifier, 'h').where('h.x = 1')
+            self.assertIn('WHERE %s\n  AND h.x = 1' % where, str(query))
+
+    def test_union_labels(self):
+        """Disjunctions of labels on the first node become UNION branches"""
+        class Airport(Node):
+            """Node example"""
+
+        class Station(Node):
+            """Node example"""
+
+        query = (Query()
+                 .configure(union_labels=True)
+                 .match(Airport | (Station & 'Hub'), 'a')
+                 .where('a.x = 1')
+                 )
+        expected = '\n'.join((
+            'MATCH (a:Airport)',
+            'WHERE a.x = 1',
+            'RETURN a',
+            'UNION ALL',
+            'MATCH (a:Hub:Station)',
+            'WHERE a.x = 1',
+            '  AND NOT a:Airport',
+            'RETURN a',
+        ))
+        self.assertEqual(str(query), expected)
+
+        expected = '\n'.join((
+            'CALL {',
+            '  MATCH (a:Airport)',
+            '  WHERE a.x = 1',
+            '  RETURN a',
+            '  UNION ALL',
+            '  MATCH (a:Hub:Station)',
+            '  WHERE a.x = 1',
+            '    AND NOT a:Airport',
+            '  RETURN a',
+            '}',
+            'RETURN a',
+            'LIMIT $_limit',
+        ))
+        self.assertEqual(str(query.limit(10)), expected)
+
+        # Branches return all the variables the prefetches carry.
+        query = (Query()
+                 .configure(union_labels=True)
+                 .match(Airport | Station, 'n')
+                 .connected_through('FLIGHT', 'r', 1, 2)
+                 .to('', 'm')
+                 .prefetch('Country', 'country', through='IN', of='n')
+                 )
+        expected = '\n'.join((
+            'CALL {',
+            '  MATCH _e = (n:Airport)-[r:FLIGHT*1..2]->(m)',
+            '  WITH *, relationships(_e) AS _a, nodes(_e)[1..-1] AS _c',
+            '  RETURN _a, _c, m, n, r',
+            '  UNION ALL',
+            '  MATCH _e = (n:Station)-[r:FLIGHT*1..2]->(m)',
+            '  WITH *, relationships(_e) AS _a, nodes(_e)[1..-1] AS _c',
+            '  WHERE NOT n:Airport',
+            '  RETURN _a, _c, m, n, r',
+            '}',
+            'OPTIONAL MATCH (n)-[:IN]-(_p0:Country)',
+            'WITH n, r, _a, _c, m, collect(DISTINCT _p0) AS country',
+            'RETURN _a, _c, m, n, country',
+        ))
+        self.assertEqual(str(query), expected)
+
+        # Off by default, and only the first node is split.
+        query = Query().match(Airport | Station, 'a')
+        self.assertEqual(str(query), '\n'.join((
+            'MATCH (a)',
+            'WHERE (a:Airport OR a:Station)',
+            'RETURN a',
+        )))
+        query = (Query()
+                 .configure(union_labels=True)
+                 .match('', 'a')
+                 .connected_through('')
+                 .to(Airport | Station, 'b')
+                 )
+        self.assertNotIn('UNION', str(query))
+
     def test_simple_where(self):
         """Check the .where() method with only .match()"""
         query = (Query()
@@ -109,6 +261,14 @@ class QueryTests(TestCase):
                  .where('exists(f.something)')
                  .where(SomeNode.attr != '2')
                  )
+        expected = '\n'.join((
+            'MATCH (f:SomeNode {name: $a})',
+            'WHERE exists(f.something)',
+            '  AND f.name <> $b',
+            'RETURN f',
+        ))
+        self.assertEqual(str(query), expected)
+
         expected = '\n'.join((
             'MATCH (f:SomeNode)',
             'WHERE f.name = $a',
@@ -116,7 +276,10 @@ class QueryTests(TestCase):
             '  AND f.name <> $b',
             'RETURN f',
         ))
-        self.assertEqual(str(query), expected)
+        self.assertEqual(
+            str(query.configure(inline_equality=False)),
+            expected,
+        )
 
         expected = {'a': 2, 'b': '2'}
         self.assertEqual(query.get_vars(), expected)
@@ -196,9 +359,8 @@ class QueryTests(TestCase):
                  .with_('')
                  )
         expected = '\n'.join((
-            'MATCH (f:SomeNode)-[_a:SOMEEDGE]-(_b)',
-            'WHERE f.node_name = $a,',
-            '  AND _a.edge_name <> $b',
+            'MATCH (f:SomeNode {node_name: $a})-[_a:SOMEEDGE]-(_b)',
+            'WHERE _a.edge_name <> $b',
             'RETURN _a, _b, f',
         ))
         self.assertEqual(str(query), expected)
@@ -239,3 +401,562 @@ class QueryTests(TestCase):
                 r'Method `match` can only be used once per query',
         ):
             Query().match('').match('')
+
+    def test_compile(self):
+        """Method .compile() should return both the Cypher and the params"""
+        class SomeNode(Node):
+            """Node example"""
+            attr = attributes.AnyAttr()
+
+        query = (Query()
+                 .match(SomeNode, 'n')
+                 .where(SomeNode.attr == 1)
+                 .where('exists(n.attr)')
+                 .where(SomeNode.attr != 3)
+                 )
+        cypher, params = query.compile()
+
+        self.assertEqual(cypher, str(query))
+        self.assertEqual(params, {'a': 1, 'b': 3})
+        self.assertEqual(params, query.get_vars())
+
+    def test_prepare(self):
+        """A prepared Template should only build the params on binding"""
+        class SomeNode(Node):
+            """Node example"""
+            attr = attributes.AnyAttr()
+            other = attributes.AnyAttr()
+
+        query = (Query()
+                 .match(SomeNode, 'n')
+                 .where(SomeNode.attr == Slot('value'))
+                 .where(SomeNode.other == 'fixed')
+                 .where(SomeNode.attr != Slot('value'))
+                 )
+        template = query.prepare()
+
+        self.assertEqual(template.cypher, str(query))
+        self.assertEqual(template.bind(value=1), {'a': 1, 'b': 'fixed'})
+        self.assertEqual(template.bind(value=2), {'a': 2, 'b': 'fixed'})
+
+        with self.assertRaisesRegex(exceptions.BadQuery, 'missing.*value'):
+            template.bind()
+        with self.assertRaisesRegex(exceptions.BadQuery, 'no slots: other'):
+            template.bind(value=1, other=2)
+        with self.assertRaises(TypeError):
+            template.params['a'] = 3
+
+    def test_builder_branching(self):
+        """Extending a query should never change the original one"""
+        base = Query().match('', 'a').where('a.x = 1')
+        first = base.where('a.y = 2', 'a.z = 3')
+        second = base.connected_through('').to('', 'b').where('b.x = 1')
+
+        self.assertEqual(len(base.conditions), 1)
+        self.assertEqual(
+            [c.where for c in first.conditions],
+            ['a.x = 1', 'a.y = 2', 'a.z = 3'],
+        )
+        self.assertEqual([c.row for c in second.conditions], [0, 2])
+        self.assertEqual(len(base.table), 1)
+        self.assertEqual(len(second.table), 3)
+
+    def test_params_deduplication(self):
+        """Equal values of the same type should share a variable"""
+        class SomeNode(Node):
+            """Node example"""
+            attr = attributes.AnyAttr()
+
+        big = list(range(1000))
+        query = (Query()
+                 .configure(inline_equality=False)
+                 .match(SomeNode, 'n')
+                 .where(SomeNode.attr == 1)
+                 .where(SomeNode.attr != True)  # pylint: disable=C0121
+                 .where(SomeNode.attr != 1)
+                 .where(SomeNode.attr == big)
+                 .where(SomeNode.attr == big)
+                 .where(SomeNode.attr == list(range(1000)))
+                 .where(SomeNode.attr == {'a': [1]})
+                 .where(SomeNode.attr == {'a': [1]})
+                 )
+        expected = '\n'.join((
+            'MATCH (n:SomeNode)',
+            'WHERE n.attr = $a',
+            '  AND n.attr <> $b',
+            '  AND n.attr <> $a',
+            '  AND n.attr = $c',
+            '  AND n.attr = $c',
+            '  AND n.attr = $c',
+            '  AND n.attr = $d',
+            '  AND n.attr = $d',
+            'RETURN n',
+        ))
+        self.assertEqual(str(query), expected)
+        self.assertEqual(
+            query.get_vars(),
+            {'a': 1, 'b': True, 'c': big, 'd': {'a': [1]}},
+        )
+
+        # Items of different types are not equal in Cypher.
+        query = (Query()
+                 .configure(inline_equality=False)
+                 .match(SomeNode, 'n')
+                 .where(SomeNode.attr == [1], SomeNode.attr == [True])
+                 .where(SomeNode.attr == (1,), SomeNode.attr == (True,))
+                 .where(SomeNode.attr == {'a': 1}, SomeNode.attr == {'a': 1.})
+                 .where(SomeNode.attr == [1])
+                 )
+        self.assertEqual(query.get_vars(), {
+            'a': [1], 'b': [True], 'c': (1,), 'd': (True,),
+            'e': {'a': 1}, 'f': {'a': 1.},
+        })
+        self.assertTrue(str(query).endswith('n.attr = $a\nRETURN n'))
+
+        # The same shape with different values must not reuse the Cypher.
+        other = Query().match(SomeNode, 'n').where(
+            SomeNode.attr == 1,
+            SomeNode.attr == 2,
+        )
+        same = Query().match(SomeNode, 'n').where(
+            SomeNode.attr == 1,
+            SomeNode.attr == 1,
+        )
+        self.assertNotEqual(str(other), str(same))
+        self.assertNotEqual(other.fingerprint(), same.fingerprint())
+
+    def test_inline_equality(self):
+        """Node equalities should go into the pattern, once per property"""
+        class SomeNode(Node):
+            """Node example"""
+            attr = attributes.AnyAttr()
+            other = attributes.AnyAttr()
+
+        class SomeEdge(Edge):
+            """Edge example"""
+            attr = attributes.AnyAttr()
+
+        query = (Query()
+                 .match(SomeNode, 'a')
+                 .where(SomeNode.attr == 1, SomeNode.other == 2)
+                 .where(SomeNode.attr == 3)
+                 .connected_through(SomeEdge, 'r')
+                 .where(SomeEdge.attr == 1)
+                 .to(SomeNode, 'b')
+                 .where(SomeNode.other != 2, SomeNode.attr == 2)
+                 )
+        expected = '\n'.join((
+            'MATCH (a:SomeNode {attr: $a, other: $b})'
+            '-[r:SOMEEDGE]->(b:SomeNode {attr: $b})',
+            'WHERE a.attr = $c',
+            '  AND r.attr = $a',
+            '  AND b.other <> $b',
+            'RETURN a, b, r',
+        ))
+        self.assertEqual(str(query), expected)
+        self.assertEqual(query.get_vars(), {'a': 1, 'b': 2, 'c': 3})
+
+    def test_index_hints(self):
+        """Equalities on indexed props should produce `USING INDEX` hints"""
+        class Airport(Node):
+            """Node example"""
+            iata = attributes.AnyAttr()
+            name = attributes.AnyAttr()
+            city = attributes.AnyAttr()
+
+            class Neo:
+                """Indexes declaration"""
+                primary_key = 'iata'
+                indexes = ('name',)
+
+        query = (Query()
+                 .configure(index_hints=True)
+                 .match(Airport, 'a')
+                 .where(Airport.name == 'Heathrow', Airport.iata == 'LHR')
+                 .where('exists(a.city)')
+                 .connected_through('', 'r')
+                 .to(Airport, 'b')
+                 .where(Airport.name == 'Gatwick', Airport.city == 'London')
+                 .connected_through('')
+                 .to('', 'c')
+                 .where(Airport.iata == 'LGW')
+                 )
+        expected = '\n'.join((
+            'MATCH (a:Airport {name: $a, iata: $b})-[r]->'
+            '(b:Airport {name: $c, city: $d}),',
+            '      (b:Airport {name: $c, city: $d})-[_a]->(c {iata: $e})',
+            'USING INDEX a:Airport(iata)',
+            'USING INDEX b:Airport(name)',
+            'WHERE exists(a.city)',
+            'RETURN _a, a, b, c, r',
+        ))
+        self.assertEqual(str(query), expected)
+
+        self.assertNotIn('USING', str(query.configure(index_hints=False)))
+
+        # With variable-length paths the WHERE part follows a WITH part,
+        # where hints are not allowed.
+        query = (Query()
+                 .configure(index_hints=True)
+                 .match(Airport, 'a')
+                 .where(Airport.iata == 'LHR', Airport.name > 'H')
+                 .connected_through('', 'r', min_hops=1, max_hops=3)
+                 .to(Airport, 'b')
+                 .where(Airport.name > 'G')
+                 )
+        self.assertIn('(a:Airport {iata: $a})', str(query))
+        self.assertIn('USING INDEX a:Airport(iata)\nWITH', str(query))
+        self.assertNotIn('Airport(name)', str(query))
+
+        query = query.configure(inline_equality=False)
+        self.assertNotIn('USING', str(query))
+
+    def test_order_skip_limit(self):
+        """ORDER BY, SKIP and LIMIT should follow the RETURN statement"""
+        class SomeNode(Node):
+            """Node example"""
+            attr = attributes.AnyAttr()
+
+        class OtherNode(Node):
+            """Node example"""
+            attr = attributes.AnyAttr()
+
+        query = (Query()
+                 .match(SomeNode)
+                 .connected_through('')
+                 .to(OtherNode, 'o')
+                 .order_by(OtherNode.attr, 'o.name', descending=True)
+                 .order_by(SomeNode.attr)
+                 .skip(20)
+                 .limit(10)
+                 )
+        expected = '\n'.join((
+            'MATCH (_a:SomeNode)-[_b]->(o:OtherNode)',
+            'RETURN _a, _b, o',
+            'ORDER BY o.attr DESC, o.name DESC, _a.attr',
+            'SKIP $_skip',
+            'LIMIT $_limit',
+        ))
+        self.assertEqual(str(query), expected)
+        self.assertEqual(query.get_vars(), {'_skip': 20, '_limit': 10})
+
+        # Another page reuses the compiled query.
+        self.assertEqual(str(query.skip(30)), expected)
+
+        with self.assertRaisesRegex(exceptions.BadQuery, 'Node is not matched'):
+            Query().match('').order_by(SomeNode.attr)
+        for bad in (-1, 1.5, '1', True):
+            with self.assertRaisesRegex(exceptions.BadQuery, 'non-negative'):
+                Query().match('').limit(bad)
+
+        # A variable-length edge has a list of values per property.
+        class Flight(Edge):
+            """Edge example"""
+            duration = attributes.AnyAttr()
+
+        hops = (Query()
+                .match(SomeNode, 'a')
+                .connected_through(Flight, 'r', 1, 3)
+                .to(OtherNode, 'b'))
+        for bad in (
+                lambda: hops.order_by(Flight.duration),
+                lambda: hops.order_by(Flight.duration('r')),
+                lambda: hops.page_after(Flight.duration, 1, 10),
+        ):
+            with self.assertRaisesRegex(exceptions.BadQuery, 'variable-len'):
+                bad()
+
+    def test_page_after(self):
+        """Keyset pagination should seek after the last seen value"""
+        class SomeNode(Node):
+            """Node example"""
+            uid = attributes.AnyAttr()
+
+            class Neo:
+                """Indexes declaration"""
+                primary_key = 'uid'
+
+        query = Query().configure(index_hints=True).match(SomeNode, 'n')
+
+        expected = '\n'.join((
+            'MATCH (n:SomeNode)',
+            'RETURN n',
+            'ORDER BY n.uid',
+            'LIMIT $_limit',
+        ))
+        first = query.page_after(SomeNode.uid, size=2)
+        self.assertEqual(str(first), expected)
+        self.assertEqual(first.get_vars(), {'_limit': 2})
+
+        expected = '\n'.join((
+            'MATCH (n:SomeNode)',
+            'USING INDEX n:SomeNode(uid)',
+            'WHERE n.uid < $a',
+            'RETURN n',
+            'ORDER BY n.uid DESC',
+            'LIMIT $_limit',
+        ))
+        page = query.page_after(SomeNode.uid, 'x', size=2, descending=True)
+        self.assertEqual(str(page), expected)
+        self.assertEqual(page.get_vars(), {'a': 'x', '_limit': 2})
+
+    def test_returning(self):
+        """Only the requested properties should be returned"""
+        class Airport(Node):
+            """Node example"""
+            iata = attributes.AnyAttr()
+            name = attributes.AnyAttr()
+
+        class Flight(Edge):
+            """Edge example"""
+            departure = attributes.AnyAttr()
+
+        query = (Query()
+                 .match(Airport, 'a')
+                 .connected_through(Flight, 'f')
+                 .to(Airport, 'b')
+                 )
+
+        projected = query.returning(
+            Airport.iata('a'),
+            Flight.departure,
+            Airport.name('a'),
+            Airport.iata('b'),
+        )
+        expected = '\n'.join((
+            'MATCH (a:Airport)-[f:FLIGHT]->(b:Airport)',
+            'RETURN a.iata, f.departure, a.name, b.iata',
+        ))
+        self.assertEqual(str(projected), expected)
+        self.assertEqual(
+            projected.decoder()(['LHR', 1, 'Heathrow', 'LGW']),
+            ('LHR', 1, 'Heathrow', 'LGW'),
+        )
+
+        mapped = query.returning(
+            Airport.iata('a'),
+            Flight.departure,
+            Airport.name('a'),
+            as_map=True,
+        ).order_by(Airport.name('a'))
+        expected = '\n'.join((
+            'MATCH (a:Airport)-[f:FLIGHT]->(b:Airport)',
+            'RETURN a {.iata, .name}, f {.departure}',
+            'ORDER BY a.name',
+        ))
+        self.assertEqual(str(mapped), expected)
+        self.assertEqual(
+            mapped.decoder()([{'iata': 'LHR'}, {'departure': 1}]),
+            {'a': {'iata': 'LHR'}, 'f': {'departure': 1}},
+        )
+
+        with self.assertRaisesRegex(exceptions.BadQuery, 'x is not matched'):
+            query.returning(Airport.iata('x'))
+
+        # A variable-length edge has a list of values per property.
+        hops = (Query()
+                .match(Airport, 'a')
+                .connected_through(Flight, 'f', 1, 3)
+                .to(Airport, 'b'))
+        for bad in (
+                lambda: hops.returning(Flight.departure),
+                lambda: hops.returning(Flight.departure('f'), as_map=True),
+                lambda: hops.aggregate(
+                    first=Aggregate('min', Flight.departure),
+                ),
+        ):
+            with self.assertRaisesRegex(exceptions.BadQuery, 'variable-len'):
+                bad()
+
+    def test_count_and_exists(self):
+        """Count and exists modes should aggregate on the server"""
+        query = (Query()
+                 .match('Airport', 'a')
+                 .connected_through('FLIGHT', min_hops=1, max_hops=2)
+                 .to('Airport', 'b')
+                 )
+
+        expected = '\n'.join((
+            'MATCH _e = (a:Airport)-[:FLIGHT*1..2]->(b:Airport)',
+            'WITH *, relationships(_e) AS _a, nodes(_e)[1..-1] AS _c',
+            'RETURN count(*) AS count',
+        ))
+        self.assertEqual(str(query.count()), expected)
+        self.assertEqual(query.count().decoder()([12]), 12)
+
+        expected = '\n'.join((
+            'MATCH _e = (a:Airport)-[:FLIGHT*1..2]->(b:Airport)',
+            'WITH *, relationships(_e) AS _a, nodes(_e)[1..-1] AS _c',
+            'WITH *',
+            'LIMIT 1',
+            'RETURN count(*) > 0 AS `exists`',
+        ))
+        self.assertEqual(str(query.exists()), expected)
+        self.assertIs(query.exists().decoder()([True]), True)
+
+        expected = '\n'.join((
+            'MATCH (a:Airport)',
+            'WITH *',
+            'SKIP $_skip',
+            'LIMIT $_limit',
+            'RETURN count(*) AS count',
+        ))
+        paged = Query().match('Airport', 'a').skip(10).limit(5).count()
+        self.assertEqual(str(paged), expected)
+
+    def test_aggregate(self):
+        """Aggregations should be returned by alias"""
+        class Airport(Node):
+            """Node example"""
+            iata = attributes.AnyAttr()
+
+        query = (Query()
+                 .match(Airport, 'a')
+                 .connected_through('', 'r')
+                 .to(Airport, 'b')
+                 .aggregate(
+                     total=Aggregate('count'),
+                     first=Aggregate('min', Airport.iata('b')),
+                     last=Aggregate('max', Airport.iata),
+                     flights=Aggregate('collect', 'r'),
+                 ))
+        expected = '\n'.join((
+            'MATCH (a:Airport)-[r]->(b:Airport)',
+            'RETURN count(*) AS `total`, min(b.iata) AS `first`, '
+            'max(a.iata) AS `last`, collect(r) AS `flights`',
+        ))
+        self.assertEqual(str(query), expected)
+
+        # Aliases are quoted, reserved words included.
+        reserved = Query().match('', 'a').aggregate(
+            all=Aggregate('collect', 'a'),
+        )
+        self.assertIn('RETURN collect(a) AS `all`', str(reserved))
+        self.assertEqual(
+            query.decoder()([3, 'A', 'Z', []]),
+            {'total': 3, 'first': 'A', 'last': 'Z', 'flights': []},
+        )
+
+        for bad in (Aggregate('median', 'a'), Aggregate('min')):
+            with self.assertRaises(exceptions.BadQuery):
+                Query().match('', 'a').aggregate(bad=bad)
+
+    def test_prefetch(self):
+        """Related entities should be collected for each result"""
+        class Airport(Node):
+            """Node example"""
+            iata = attributes.AnyAttr()
+
+        class Flight(Edge):
+            """Edge example"""
+
+        query = (Query()
+                 .match(Airport, 'a')
+                 .connected_through('', 'r', 1, 2)
+                 .to(Airport)
+                 .prefetch(Flight, 'flights', direction=True)
+                 .prefetch('Country', 'country', through='IN', of='a')
+                 .order_by(Airport.iata('a'))
+                 .limit(10)
+                 )
+        expected = '\n'.join((
+            'MATCH _e = (a:Airport)-[r*1..2]->(_f:Airport)',
+            'WITH *, relationships(_e) AS _a, nodes(_e)[1..-1] AS _c',
+            'WITH *',
+            'ORDER BY a.iata',
+            'LIMIT $_limit',
+            'OPTIONAL MATCH (_f)-[_p0:FLIGHT]->()',
+            'WITH a, r, _a, _c, _f, collect(_p0) AS flights',
+            'OPTIONAL MATCH (a)-[:IN]-(_p1:Country)',
+            'WITH a, r, _a, _c, _f, flights, collect(DISTINCT _p1) AS country',
+            'RETURN _a, _c, _f, a, flights, country',
+            'ORDER BY a.iata',
+        ))
+        self.assertEqual(str(query), expected)
+
+        mapped = (Query()
+                  .match(Airport, 'a')
+                  .prefetch(Flight, 'flights', direction=False)
+                  .returning(Airport.iata, as_map=True)
+                  )
+        expected = '\n'.join((
+            'MATCH (a:Airport)',
+            'OPTIONAL MATCH (a)<-[_p0:FLIGHT]-()',
+            'WITH a, collect(_p0) AS flights',
+            'RETURN a {.iata}, flights',
+        ))
+        self.assertEqual(str(mapped), expected)
+        self.assertEqual(
+            mapped.decoder()([{'iata': 'ORY'}, []]),
+            {'a': {'iata': 'ORY'}, 'flights': []},
+        )
+
+        # Inflated nodes get their related entities attached.
+        class Port(entities.Node):
+            """New API node example"""
+
+        port, other = Port(), Port()
+        decode = (Query()
+                  .match(Airport, 'a')
+                  .connected_through('')
+                  .to(Airport)
+                  .prefetch(Airport, 'near', of='a')
+                  .decoder())
+        self.assertEqual(
+            decode([None, None, port, [other]]),
+            (None, None, port, [other]),
+        )
+        self.assertEqual(port.prefetched('near'), [other])
+        with self.assertRaises(KeyError):
+            other.prefetched('near')
+
+        edge = Query().match(Airport, 'a').connected_through(Flight)
+        for bad in (
+                lambda: edge.prefetch(Airport, 'b'),
+                lambda: query.prefetch(Airport, 'a'),
+                lambda: query.prefetch(Airport, 'flights'),
+                # Aggregating modes would drop the lists.
+                query.count,
+                query.exists,
+                lambda: query.aggregate(total=Aggregate('count')),
+                lambda: Query().match(Airport).count().prefetch(Flight, 'f'),
+        ):
+            with self.assertRaises(exceptions.BadQuery):
+                bad()
+
+
+class CacheTests(TestCase):
+    """Compiled queries cache tests"""
+    def setUp(self):
+        CACHE.clear()
+
+    def test_same_shape_hits_the_cache(self):
+        """Queries differing only in bound values should share the Cypher"""
+        class SomeNode(Node):
+            """Node example"""
+            attr = attributes.AnyAttr()
+
+        first = Query().match(SomeNode).where(SomeNode.attr == 1)
+        second = Query().match(SomeNode).where(SomeNode.attr == 2)
+
+        self.assertEqual(str(first), str(second))
+        self.assertEqual(CACHE.info().misses, 1)
+        self.assertEqual(CACHE.info().hits, 1)
+        self.assertEqual(second.get_vars(), {'a': 2})
+
+        third = Query().match(SomeNode).where(SomeNode.attr != 2)
+        self.assertNotEqual(str(first), str(third))
+        self.assertEqual(CACHE.info().misses, 2)
+
+    def test_lru_eviction(self):
+        """The least recently used value should be evicted first"""
+        cache = CompiledCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(tuple(cache.info()), (3, 1, 2, 2))
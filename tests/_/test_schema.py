@@ -0,0 +1,149 @@
+"""Tests for neopath.schema"""
+from unittest import TestCase
+
+from neopath import entities
+from neopath._.entities import Edge, Node
+from neopath._.schema import (
+    Index,
+    Schema,
+    declared_indexes,
+    parse_index,
+    parse_version,
+)
+
+
+class Runner:
+    """Fake neo4j session returning the given `db.indexes()` records"""
+    def __init__(self, *records, version='4.3.2'):
+        self.records = records
+        self.version = version
+        self.statements = []
+
+    def run(self, statement):
+        """Record the statement"""
+        self.statements.append(statement)
+        if statement == 'CALL db.indexes()':
+            return self.records
+        if statement == 'CALL dbms.components()':
+            return ({'name': 'Neo4j Kernel', 'versions': [self.version]},)
+        return ()
+
+
+class Airport(Node):
+    """Node example"""
+    class Neo:
+        """Indexes declaration"""
+        primary_key = 'iata'
+        indexes = ('name', 'city')
+
+
+class Flight(Edge):
+    """Edge example"""
+    class Neo:
+        """Indexes declaration"""
+        indexes = ('number',)
+
+
+class Station(entities.Node):
+    """New API node example"""
+    class Meta:
+        """Indexes declaration"""
+        labels = ('Station', 'Hub')
+        primary_key = 'code'
+        indexes = ('name',)
+        index_label = 'Station'
+
+
+class SchemaTests(TestCase):
+    """Schema tests"""
+    def test_declared_indexes(self):
+        """Indexes should be collected from Nodes and Edges"""
+        self.assertEqual(declared_indexes([Airport], [Flight]), [
+            Index('Airport', 'city'),
+            Index('Airport', 'iata', unique=True),
+            Index('Airport', 'name'),
+            Index('FLIGHT', 'number', is_node=False),
+        ])
+
+        self.assertIn(Index('Airport', 'iata', True), declared_indexes())
+        self.assertIn(
+            Index('FLIGHT', 'number', is_node=False),
+            declared_indexes(),
+        )
+
+        # The keys upserts merge on are declared by the new API nodes.
+        self.assertEqual(declared_indexes([Station], []), [
+            Index('Station', 'code', unique=True),
+            Index('Station', 'name'),
+        ])
+        self.assertIn(Index('Station', 'code', True), declared_indexes())
+
+    def test_parse_index(self):
+        """Both 3.5 and 4.x formats should be understood"""
+        self.assertEqual(
+            parse_index({
+                'tokenNames': ['Airport'],
+                'properties': ['iata'],
+                'type': 'node_unique_property',
+            }),
+            Index('Airport', 'iata', unique=True),
+        )
+        self.assertEqual(
+            parse_index({
+                'labelsOrTypes': ['FLIGHT'],
+                'properties': ['number'],
+                'uniqueness': 'NONUNIQUE',
+                'entityType': 'RELATIONSHIP',
+            }),
+            Index('FLIGHT', 'number', is_node=False),
+        )
+        self.assertIsNone(parse_index({
+            'labelsOrTypes': ['Airport'],
+            'properties': ['iata', 'name'],
+        }))
+
+    def test_sync(self):
+        """Only the missing indexes should be created"""
+        runner = Runner(
+            {'tokenNames': ['Airport'], 'properties': ['name']},
+            {'tokenNames': ['Airport'], 'properties': ['iata']},
+        )
+        schema = Schema(runner, [Airport], [Flight])
+        expected = [
+            'CREATE INDEX ON :Airport(city)',
+            'DROP INDEX ON :Airport(iata)',
+            'CREATE CONSTRAINT ON (n:Airport) ASSERT n.iata IS UNIQUE',
+            'CREATE INDEX FOR ()-[r:FLIGHT]-() ON (r.number)',
+        ]
+
+        self.assertEqual(schema.sync(dry_run=True), expected)
+        self.assertEqual(runner.statements, [
+            'CALL db.indexes()',
+            'CALL dbms.components()',
+        ])
+
+        runner.statements.clear()
+        self.assertEqual(schema.sync(), expected)
+        self.assertEqual(runner.statements, ['CALL db.indexes()', *expected])
+
+    def test_edge_indexes_version(self):
+        """Edge indexes should be left out before Neo4j 4.3"""
+        self.assertEqual(
+            parse_version([
+                {'name': 'Neo4j Kernel', 'versions': ['3.5.14-enterprise']},
+            ]),
+            (3, 5, 14),
+        )
+
+        for version in ('3.5.14', '4.2.0'):
+            schema = Schema(Runner(version=version), [Airport], [Flight])
+            self.assertNotIn(
+                'CREATE INDEX FOR ()-[r:FLIGHT]-() ON (r.number)',
+                schema.diff(),
+            )
+
+        schema = Schema(Runner(), [Airport], [Flight], version=(4, 4))
+        self.assertIn(
+            'CREATE INDEX FOR ()-[r:FLIGHT]-() ON (r.number)',
+            schema.diff(),
+        )
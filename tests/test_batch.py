@@ -0,0 +1,240 @@
+"""Tests for neopath.batch"""
+from unittest import TestCase
+
+from neopath.batch import (
+    BUFFERED_CHUNKS,
+    Batch,
+    Write,
+    estimate_size,
+    execute,
+    upserts,
+    writes,
+)
+from neopath.entities import Edge, Node
+from neopath.exceptions import BadEndpoints, NullPrimaryKey
+from neopath.props import Prop
+
+
+class Runner:
+    """Fake runner recording the statements."""
+    def __init__(self):
+        self.statements = []
+        self.next_id = 0
+
+    def run(self, statement, params):
+        """Record the statement and return ids for created entities."""
+        self.statements.append((statement, params))
+        if 'RETURN' not in statement:
+            return []
+        records = []
+        for row in params['rows']:
+            self.next_id += 1
+            records.append((row[0], self.next_id))
+        return records
+
+
+class FailingRunner(Runner):
+    """Fake runner failing on the statement of index `failing`."""
+    def __init__(self, failing):
+        super().__init__()
+        self.failing = failing
+
+    def run(self, statement, params):
+        """Record the statement, raise if it is the failing one."""
+        if len(self.statements) == self.failing:
+            self.statements.append((statement, params))
+            raise ConnectionError(statement)
+        return super().run(statement, params)
+
+
+class Airport(Node):
+    """Node subclass."""
+    name = Prop()
+    code = Prop(prop_name='iata')
+
+
+class Hub(Node):
+    """Node subclass with a primary key."""
+    class Meta:
+        primary_key = 'iata'
+    code = Prop(prop_name='iata')
+
+
+class Station(Node):
+    """Node subclass."""
+    name = Prop()
+
+
+class Flight(Edge):
+    """Edge subclass."""
+    number = Prop()
+
+
+class BatchTests(TestCase):
+    """Tests for Batch class."""
+    def test_writes(self):
+        """Entities should be grouped by labels and changed props."""
+        airports = [Airport() for _ in range(3)]
+        for airport in airports:
+            airport.name = 'A'
+        saved = Airport()
+        saved._id, saved.code, saved._changed = 10, 'ORY', {'iata'}
+        clean = Station()
+        clean._id, clean._changed = 11, frozenset()
+
+        actual = [
+            (write.statement, write.params['rows'])
+            for write in writes(airports + [saved, clean], chunk_size=2)
+        ]
+        create = (
+            'UNWIND $rows AS row\n'
+            'CREATE (e:Airport)\n'
+            'SET e = row[1]\n'
+            'RETURN row[0], id(e)'
+        )
+        expected = [
+            (create, [[0, {'name': 'A'}], [1, {'name': 'A'}]]),
+            (create, [[0, {'name': 'A'}]]),
+            (
+                'UNWIND $rows AS row\n'
+                'MATCH (e) WHERE id(e) = row[0]\n'
+                'SET e.iata = row[1]',
+                [[10, 'ORY']],
+            ),
+        ]
+        self.assertEqual(actual, expected)
+
+    def test_flush(self):
+        """Nodes should be created before the edges between them."""
+        runner = Runner()
+        start, end = Airport(), Station()
+        flight = Flight(start, end)
+        flight.number = 1
+
+        with Batch(runner) as batch:
+            batch.add(flight)
+            batch.extend((start, end, start))
+            self.assertEqual(runner.statements, [])
+
+        self.assertEqual(len(runner.statements), 3)
+        self.assertEqual((start._id, end._id, flight._id), (1, 2, 3))
+        self.assertEqual(runner.statements[-1][1], {'rows': [[0, 1, 2, {
+            'number': 1,
+        }]]})
+        self.assertEqual(flight._changed, frozenset())
+
+        flight.number = 2
+        start.name = 'Orly'
+        with Batch(runner) as batch:
+            batch.extend((flight, start))
+        self.assertEqual(runner.statements[-2:], [
+            (
+                'UNWIND $rows AS row\n'
+                'MATCH (e) WHERE id(e) = row[0]\n'
+                'SET e.name = row[1]',
+                {'rows': [[1, 'Orly']]},
+            ),
+            (
+                'UNWIND $rows AS row\n'
+                'MATCH ()-[e]->() WHERE id(e) = row[0]\n'
+                'SET e.number = row[1]',
+                {'rows': [[3, 2]]},
+            ),
+        ])
+
+        # Entities not written because of a failure stay pending.
+        airport, station = Airport(), Station()
+        detached = Flight(airport, None)
+        batch = Batch(runner)
+        batch.extend((detached, airport, station))
+        with self.assertRaises(BadEndpoints):
+            batch.flush()
+        self.assertIsNotNone(airport._id)
+        self.assertEqual(list(batch._pending.values()), [detached])
+
+        detached._end = station
+        batch.flush()
+        self.assertIsNotNone(detached._id)
+        self.assertEqual(batch._pending, {})
+
+    def test_flush_failure(self):
+        """Entities of the writes after a failing one should stay pending."""
+        runner = FailingRunner(failing=1)
+        airports = [Airport() for _ in range(3)]
+        batch = Batch(runner, chunk_size=1)
+        batch.extend(airports)
+        with self.assertRaises(ConnectionError):
+            batch.flush()
+        self.assertEqual(len(runner.statements), 2)
+        self.assertIsNotNone(airports[0]._id)
+        self.assertEqual(list(batch._pending.values()), airports[1:])
+        self.assertTrue(all(airport._id is None for airport in airports[1:]))
+
+        runner.failing = None
+        batch.flush()
+        self.assertEqual(len(runner.statements), 4)
+        self.assertTrue(all(airport._id for airport in airports))
+        self.assertEqual(batch._pending, {})
+
+    def test_auto_flush(self):
+        """Pending entities should be flushed once enough are buffered."""
+        runner = Runner()
+        batch = Batch(runner, chunk_size=2)
+        airports = [Airport() for _ in range(2 * BUFFERED_CHUNKS)]
+        batch.extend(airports[:-1])
+        self.assertEqual(runner.statements, [])
+        self.assertEqual(len(batch._pending), 2 * BUFFERED_CHUNKS - 1)
+
+        batch.add(airports[-1])
+        self.assertEqual(len(runner.statements), BUFFERED_CHUNKS)
+        self.assertEqual(batch._pending, {})
+        self.assertTrue(all(airport._id for airport in airports))
+
+    def test_execute(self):
+        """Only the written props should be marked as saved."""
+        airport = Airport()
+        airport._id, airport._changed = 10, frozenset(('iata', 'name'))
+        write = Write(
+            'UNWIND $rows AS row\n'
+            'MATCH (e) WHERE id(e) = row[0]\n'
+            'SET e.iata = row[1]',
+            {'rows': [[10, None]]},
+            [airport],
+            ('iata',),
+        )
+        execute(write, Runner())
+        self.assertEqual(airport._changed, {'name'})
+        self.assertEqual(airport._id, 10)
+
+    def test_upserts(self):
+        """Chunks should be bounded by their size and estimated memory."""
+        hubs = []
+        for code in ('ORY', 'CDG', 'LHR'):
+            hub = Hub()
+            hub.code = code
+            hubs.append(hub)
+        hubs[2].labels = ('Hub', 'Big')
+
+        actual = list(upserts(iter(hubs), chunk_size=10))
+        self.assertEqual([write.entities for write in actual], [
+            hubs[:2], hubs[2:],
+        ])
+        self.assertEqual(actual[0].statement, (
+            'UNWIND $rows AS row\n'
+            'MERGE (e:Hub {iata: row[1]})\n'
+            'SET e += row[2]\n'
+            'RETURN row[0], id(e)'
+        ))
+        self.assertEqual(actual[0].params, {'rows': [
+            [0, 'ORY', {'iata': 'ORY'}], [1, 'CDG', {'iata': 'CDG'}],
+        ]})
+        self.assertIn('SET e:Big', actual[1].statement)
+
+        row_size = estimate_size([0, 'ORY', {'iata': 'ORY'}])
+        actual = list(upserts(hubs[:2], budget=row_size))
+        self.assertEqual([len(write.entities) for write in actual], [1, 1])
+        actual = list(upserts(hubs[:2], chunk_size=1))
+        self.assertEqual([len(write.entities) for write in actual], [1, 1])
+
+        with self.assertRaises(NullPrimaryKey):
+            list(upserts([*hubs, Hub()]))
@@ -1,12 +1,42 @@
 """Tests for neopath.entities"""
+import gc
 from unittest import TestCase
+from weakref import ref
+
+from neo4j.types.graph import Graph
 
 # from neopath import exceptions
-from neopath.entities import Node, MetaEntity
-from neopath.exceptions import BadLabels
+from neopath.entities import (
+    Edge,
+    Endpoints,
+    MetaEntity,
+    MetaNode,
+    Node,
+    inflate,
+)
+from neopath.exceptions import (
+    BadEndpoints,
+    BadIndexes,
+    BadLabels,
+    BadType,
+    Detached,
+    NoPrimaryKey,
+    NullPrimaryKey,
+)
 from neopath.props import Prop
 
 
+class Runner:
+    """Fake runner recording the statements."""
+    def __init__(self):
+        self.statements = []
+
+    def run(self, statement, params):
+        """Record the statement and return a created id."""
+        self.statements.append((statement, params))
+        return [(len(self.statements),)]
+
+
 class MetaEntityTests(TestCase):
     """Tests for MetaEntity class."""
     def test_entity_and_prop_name_on_properties(self):
@@ -59,6 +89,335 @@ class NodeTests(TestCase):
                 print(bad_labels)
                 node.labels = bad_labels
 
+    def test_indexes(self):
+        """Meta should record the indexed props, including the primary key."""
+        class SomeNode(Node):
+            """Node subclass."""
+        class OtherNode(Node):
+            """Node subclass."""
+            class Meta:
+                primary_key = 'uid'
+                indexes = ('name',)
+
+        self.assertIsNone(SomeNode._meta.primary_key)
+        self.assertEqual(SomeNode._meta.indexes, frozenset())
+        self.assertEqual(OtherNode._meta.primary_key, 'uid')
+        self.assertEqual(OtherNode._meta.indexes, {'uid', 'name'})
+        self.assertEqual(OtherNode._meta.index_label, 'OtherNode')
+
+        class LabelledNode(Node):
+            """Node subclass with several labels."""
+            class Meta:
+                labels = ('Depot', 'Stop')
+                primary_key = 'uid'
+                index_label = 'Depot'
+        self.assertEqual(LabelledNode._meta.index_label, 'Depot')
+
+        for bad_meta in (
+                {'primary_key': 1},
+                {'indexes': 'name'},
+                {'indexes': ('name', None)},
+                {'labels': ('Depot', 'Stop'), 'primary_key': 'uid'},
+                {'primary_key': 'uid', 'index_label': 'Other'},
+        ):
+            with self.assertRaises(BadIndexes):
+                type('BadNode', (Node,), {'Meta': type('Meta', (), bad_meta)})
+
+    def test_inflate(self):
+        """Declared props and extra labels should be read from a neo4j node."""
+        class SomeNode(Node):
+            """Node subclass."""
+            name = Prop()
+            code = Prop(prop_name='iata')
+
+        graph = Graph()
+        node = SomeNode.inflate(graph.put_node(
+            1, ('SomeNode',), {'name': 'Orly', 'iata': 'ORY', 'other': 0},
+        ))
+        self.assertEqual(node._id, 1)
+        self.assertEqual((node.name, node.code), ('Orly', 'ORY'))
+        self.assertFalse(hasattr(node, 'other'))
+        self.assertEqual(node.labels, {'SomeNode'})
+
+        node = SomeNode.inflate(graph.put_node(2, ('SomeNode', 'Extra')))
+        self.assertEqual(node.labels, {'SomeNode', 'Extra'})
+        with self.assertRaises(BadLabels):
+            SomeNode.inflate(graph.put_node(3, ('Other',)))
+
+    def test_slots(self):
+        """Props should be stored in slots, labels only when they differ."""
+        class SomeNode(Node):
+            """Node subclass."""
+            name = Prop()
+        class OtherNode(SomeNode):
+            """Node subclass."""
+            name = Prop(prop_name='other_name')
+            code = Prop()
+
+        node = OtherNode()
+        self.assertFalse(hasattr(node, '__dict__'))
+        self.assertIsNone(node.code)
+        node.name, node.code = 'Orly', 'ORY'
+        self.assertEqual((node.name, node.code), ('Orly', 'ORY'))
+        del node.code
+        self.assertIsNone(node.code)
+        with self.assertRaises(AttributeError):
+            node.undeclared = 1
+        self.assertNotIn('_prop_name', OtherNode.__slots__)
+        self.assertIsInstance(OtherNode.name, Prop)
+
+        self.assertFalse(hasattr(node, '_labels'))
+        node.labels = ('OtherNode', 'Extra')
+        self.assertEqual(node._labels, {'OtherNode', 'Extra'})
+        node.labels = ('OtherNode',)
+        self.assertFalse(hasattr(node, '_labels'))
+
+    def test_save(self):
+        """Only the changed props should be written, if any."""
+        class SomeNode(Node):
+            """Node subclass."""
+            name = Prop()
+            code = Prop(prop_name='iata')
+
+        runner = Runner()
+        node = SomeNode()
+        node.name = 'Orly'
+        node.save(runner)
+        self.assertEqual(node._id, 1)
+        self.assertEqual(runner.statements[-1], (
+            'CREATE (e:SomeNode $props)\nRETURN id(e)',
+            {'props': {'name': 'Orly'}},
+        ))
+
+        node.save(runner)
+        node.name = 'Orly'
+        node.save(runner)
+        self.assertEqual(len(runner.statements), 1)
+
+        # Values of another type are saved differently.
+        for old, value in ((1, True), (1, 1.), ([1], [True])):
+            node.code = old
+            node._changed = frozenset()
+            node.code = value
+            self.assertEqual(node._changed, {'iata'})
+            node.code = value
+            self.assertEqual(node._changed, {'iata'})
+        node.code = None
+        node.save(runner)
+
+        node.code = 'ORY'
+        del node.name
+        self.assertEqual(node._changed, {'iata', 'name'})
+        node.save(runner)
+        self.assertEqual(runner.statements[-1], (
+            'MATCH (e) WHERE id(e) = $id\nSET e.iata = $p0, e.name = $p1',
+            {'id': 1, 'p0': 'ORY', 'p1': None},
+        ))
+        self.assertEqual(node._changed, frozenset())
+        count = len(runner.statements)
+
+        node = SomeNode.inflate(
+            Graph().put_node(7, ('SomeNode',), {'name': 'x'}),
+        )
+        node.save(runner)
+        self.assertEqual(len(runner.statements), count)
+
+    def test_upsert(self):
+        """Nodes should be merged on their primary key."""
+        class SomeNode(Node):
+            """Node subclass."""
+            class Meta:
+                primary_key = 'iata'
+            code = Prop(prop_name='iata')
+            name = Prop()
+
+        runner = Runner()
+        node = SomeNode()
+        node.code, node.name = 'ORY', 'Orly'
+        node.labels = ('SomeNode', 'Hub')
+        node.upsert(runner)
+
+        self.assertEqual(node._id, 1)
+        self.assertEqual(node._changed, frozenset())
+        self.assertEqual(runner.statements[-1], (
+            'MERGE (e:SomeNode {iata: $key})\n'
+            'SET e:Hub\n'
+            'SET e += $props\n'
+            'RETURN id(e)',
+            {'key': 'ORY', 'props': {'iata': 'ORY', 'name': 'Orly'}},
+        ))
+
+        class OtherNode(Node):
+            """Node subclass without a primary key."""
+        with self.assertRaises(NoPrimaryKey):
+            OtherNode().upsert(runner)
+
+        # Neo4j can not MERGE on a null property.
+        count = len(runner.statements)
+        with self.assertRaises(NullPrimaryKey):
+            SomeNode().upsert(runner)
+        self.assertEqual(len(runner.statements), count)
+
+    def test_best_match(self):
+        """Neo4j nodes should be inflated into the most specific class."""
+        class Airdrome(Node):
+            """Node subclass."""
+        class Airport(Airdrome):
+            """Node subclass."""
+        class BusStation(Node):
+            """Node subclass."""
+            class Meta:
+                labels = ('BusStation', 'Station')
+
+        self.assertIs(MetaNode.best_match({'Airdrome'}), Airdrome)
+        self.assertIs(MetaNode.best_match({'Airdrome', 'Airport'}), Airport)
+        self.assertIs(MetaNode.best_match(('Airport', 'Extra')), Airport)
+        self.assertIs(
+            MetaNode.best_match({'BusStation', 'Station', 'Airdrome'}),
+            BusStation,
+        )
+        self.assertIsNone(MetaNode.best_match({'BusStation'}))
+
+        graph = Graph()
+        nodes = [
+            graph.put_node(1, ('Airdrome', 'Airport')),
+            graph.put_node(2, ('Station', 'BusStation')),
+            graph.put_node(3, ('Unknown',)),
+        ]
+        airport, station, unknown = inflate(nodes)
+        self.assertIsInstance(airport, Airport)
+        self.assertEqual(airport.labels, {'Airdrome', 'Airport'})
+        self.assertIsInstance(station, BusStation)
+        self.assertIs(unknown, nodes[2])
+        self.assertEqual(inflate(1), 1)
+
+    def test_best_match_weak(self):
+        """Kept best matches should not keep dropped classes alive."""
+        class Hangar(Node):
+            """Node subclass."""
+
+        self.assertIs(MetaNode.best_match({'Hangar', 'Extra'}), Hangar)
+        self.assertIsNone(MetaNode.best_match({'Apron'}))
+        hangar = ref(Hangar)
+        del Hangar
+        gc.collect()
+        self.assertIsNone(hangar())
+        self.assertIsNone(MetaNode.best_match({'Hangar', 'Extra'}))
+        self.assertIsNone(MetaNode.best_match({'Apron'}))
+
+
+class EdgeTests(TestCase):
+    """Tests for Edge class."""
+    def test_inflate(self):
+        """Props and endpoint ids should be read from a neo4j relationship."""
+        class SomeEdge(Edge):
+            """Edge subclass."""
+            departure = Prop()
+
+        graph = Graph()
+        start, end = graph.put_node(1), graph.put_node(2)
+        edge = SomeEdge.inflate(graph.put_relationship(
+            3, start, end, 'SOMEEDGE', {'departure': 10},
+        ))
+        self.assertEqual(edge._id, 3)
+        self.assertEqual(edge.departure, 10)
+        self.assertEqual((edge._start, edge._end), (1, 2))
+
+    def test_endpoints(self):
+        """Endpoints should be loaded all at once on the first access."""
+        class SomeNode(Node):
+            """Node subclass."""
+        class SomeEdge(Edge):
+            """Edge subclass."""
+
+        graph = Graph()
+        nodes = [graph.put_node(i, ('SomeNode',)) for i in range(4)]
+        edges = [
+            graph.put_relationship(10 + i, nodes[i], nodes[i + 1], 'SOMEEDGE')
+            for i in range(3)
+        ]
+
+        class NodesRunner:
+            """Fake runner returning the requested nodes."""
+            def __init__(self):
+                self.statements = []
+
+            def run(self, statement, params):
+                """Record the statement and return the nodes."""
+                self.statements.append((statement, params))
+                return [(nodes[i],) for i in params['ids'] if i != 3]
+
+        runner = NodesRunner()
+        endpoints = Endpoints(runner)
+        first = endpoints.inflate(nodes[0])
+        inflated = endpoints.inflate(edges)
+        self.assertTrue(all(isinstance(e, SomeEdge) for e in inflated))
+        self.assertEqual(runner.statements, [])
+
+        self.assertIs(inflated[0].start_node(), first)
+        self.assertIsInstance(inflated[0].end_node(), SomeNode)
+        self.assertIs(inflated[0].end_node(), inflated[1].start_node())
+        self.assertIsNone(inflated[2].end_node())
+        self.assertEqual(runner.statements, [(
+            'MATCH (n) WHERE id(n) IN $ids\nRETURN n',
+            {'ids': [1, 2, 3]},
+        )])
+
+        edge = SomeEdge.inflate(edges[0])
+        with self.assertRaises(Detached):
+            edge.start_node()
+        self.assertIs(SomeEdge(first).start_node(), first)
+
+    def test_type(self):
+        """Type should come from the class name if not set in Meta."""
+        class SomeEdge(Edge):
+            """Edge subclass."""
+        class OtherEdge(Edge):
+            """Edge subclass."""
+            class Meta:
+                type = 'OTHER'
+
+        self.assertEqual(SomeEdge.type, 'SOMEEDGE')
+        self.assertEqual(OtherEdge.type, 'OTHER')
+        for bad_type in ('', None, ('A',)):
+            with self.assertRaises(BadType):
+                type('BadEdge', (Edge,), {'Meta': type('Meta', (), {
+                    'type': bad_type,
+                })})
+
+    def test_save(self):
+        """Edges should be created between saved nodes, then updated."""
+        class SomeNode(Node):
+            """Node subclass."""
+        class SomeEdge(Edge):
+            """Edge subclass."""
+            departure = Prop()
+
+        runner = Runner()
+        start, end = SomeNode(), SomeNode()
+        edge = SomeEdge(start, end)
+        with self.assertRaises(BadEndpoints):
+            edge.save(runner)
+
+        start.save(runner)
+        end.save(runner)
+        edge.departure = 10
+        edge.save(runner)
+        self.assertEqual(edge._id, 3)
+        self.assertEqual(runner.statements[-1], (
+            'MATCH (s), (t) WHERE id(s) = $start AND id(t) = $end\n'
+            'CREATE (s)-[e:SOMEEDGE $props]->(t)\n'
+            'RETURN id(e)',
+            {'start': 1, 'end': 2, 'props': {'departure': 10}},
+        ))
+
+        edge.departure = 11
+        edge.save(runner)
+        self.assertEqual(runner.statements[-1], (
+            'MATCH ()-[e]->() WHERE id(e) = $id\nSET e.departure = $p0',
+            {'id': 3, 'p0': 11},
+        ))
+
 
 # class NodeTests(TestCase):
     # def test_neo_attribute(self):
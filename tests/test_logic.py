@@ -2,7 +2,16 @@
 from operator import and_, or_, xor
 from unittest import TestCase
 
-from neopath.logic import BitwiseMixin, And, Or, Xor, Not
+from neopath.logic import (
+    BitwiseMixin,
+    And,
+    Or,
+    Xor,
+    Not,
+    inline_and_where,
+    label_branches,
+    optimize,
+)
 
 
 class BitwiseMixinTest(TestCase):
@@ -34,3 +43,58 @@ class BitwiseMixinTest(TestCase):
         result = Not(self.first, self.second)
         self.assertIsInstance(result, Not)
         self.assertEqual(result, (self.first, self.second))
+
+
+class OptimizeTest(TestCase):
+    """Test the optimisation of logical expressions."""
+    def test_absorption(self):
+        """A & (A | B) and A | (A & B) are A."""
+        self.assertEqual(optimize(And('A', Or('A', 'B'))), 'A')
+        self.assertEqual(optimize(Or('A', And('A', 'B'))), 'A')
+        self.assertEqual(optimize(Or(And('A', 'B'), And('B', 'A'))),
+                         And('A', 'B'))
+
+    def test_constants(self):
+        """Contradictions become Or(), tautologies And()."""
+        for expression in (And('A', Not('A')), Xor('A', 'A')):
+            result = optimize(expression)
+            self.assertIsInstance(result, Or)
+            self.assertEqual(result, ())
+
+        for expression in (Or('A', Not('A')), Or('A', And())):
+            result = optimize(expression)
+            self.assertIsInstance(result, And)
+            self.assertEqual(result, ())
+
+        self.assertEqual(optimize(Not(Not('A'))), 'A')
+        self.assertEqual(optimize(Xor('A', 'B', 'A')), 'B')
+        self.assertEqual(optimize(Xor('A', And())), Not('A'))
+
+    def test_flatten(self):
+        """Nested operations of the same kind are flattened."""
+        self.assertEqual(optimize(And('B', And('A', Or('C', Or('D'))))),
+                         And('A', 'B', Or('C', 'D')))
+
+    def test_inline_and_where(self):
+        """Labels shared by all the branches are hoisted inline."""
+        self.assertEqual(inline_and_where(And('B', 'A')), (':A:B', ''))
+        self.assertEqual(
+            inline_and_where(Or(And('Hub', 'Airport'), And('Hub', 'Port'))),
+            (':Hub', '({0}:Airport OR {0}:Port)'),
+        )
+        self.assertEqual(
+            inline_and_where(And('A', Or('B', And('C', 'D')), Not('E'))),
+            (':A', '({0}:B OR {0}:C:D) AND NOT {0}:E'),
+        )
+        self.assertEqual(inline_and_where(Or('A', And('A', 'B'))),
+                         (':A', ''))
+        self.assertEqual(inline_and_where(And('A', Not('A'))), ('', 'false'))
+
+    def test_label_branches(self):
+        """Disjunctions of labels are split into branches."""
+        self.assertEqual(
+            label_branches(Or('C', And('B', 'A'), And('A', 'B', 'D'))),
+            (('A', 'B'), ('C',)),
+        )
+        self.assertEqual(label_branches(And('A', 'B')), ())
+        self.assertEqual(label_branches(Or('A', Not('B'))), ())